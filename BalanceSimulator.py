@@ -0,0 +1,339 @@
+# ---------------------------------
+# Combat & healing balance simulator
+# ---------------------------------
+
+# Plays the combat and item rules of Castle Escape (the statue, the zombie princess,
+# the basement creatures, food and the potion) millions of times to see how often
+# each kind of player wins or dies, and how that changes when the numbers change.
+#
+# Instead of running one GameSession at a time, every playthrough is one row of a
+# few NumPy arrays (health, weapons, keys, ...), and each step of the route is done
+# for all the rows at once. A million playthroughs take about a second.
+#
+# Needs NumPy (pip install numpy); the game itself doesn't.
+#
+# From the command line:
+#     python BalanceSimulator.py --runs 1000000
+#     python BalanceSimulator.py --sweep statue_flee_damage=5,10,15,20 --json
+#     python BalanceSimulator.py --check   # compare with the real game engine
+
+import argparse
+import json
+
+import numpy as np
+
+# The numbers the rules in AdventureGame.py use. The enemy templates in `rooms`
+# have their own "damage" values, but no rule reads them.
+DEFAULT_PARAMS = {
+    "start_health": 20,
+    "statue_fight_damage": 5,
+    "statue_flee_damage": 10,
+    "princess_sword_damage": 0,
+    "princess_dagger_damage": 5,
+    "princess_bare_damage": 10,
+    "princess_flee_damage": 7,
+    "creatures_sword_damage": 0,
+    "creatures_dagger_damage": 5,
+    "creatures_bare_damage": 10,
+    "creatures_flee_damage": 5,
+    "food_heal": 5,
+    "potion_heal": 10,
+}
+
+# A strategy is the chance that a player makes each choice:
+# - sword: go for the sword in the hidden room (and wake the statue)
+# - fight_statue: fight the statue rather than flee (fleeing loses the sword)
+# - food / dagger / potion: pick them up on the way
+# - potion_below: drink the potion before a fight once health is at or below this
+# - fight_princess / fight_creatures: fight rather than flee, at each encounter
+# - max_encounters: how many times they face each enemy before giving up
+STRATEGIES = {
+    "hero": {
+        "sword": 1.0, "fight_statue": 1.0, "food": 1.0, "dagger": 1.0, "potion": 1.0, "potion_below": 10,
+        "fight_princess": 1.0, "fight_creatures": 1.0, "max_encounters": 3,
+    },
+    "speedrun": {
+        "sword": 0.0, "fight_statue": 1.0, "food": 0.0, "dagger": 1.0, "potion": 0.0, "potion_below": 0,
+        "fight_princess": 1.0, "fight_creatures": 1.0, "max_encounters": 3,
+    },
+    "barehanded": {
+        "sword": 0.0, "fight_statue": 1.0, "food": 1.0, "dagger": 0.0, "potion": 1.0, "potion_below": 10,
+        "fight_princess": 1.0, "fight_creatures": 1.0, "max_encounters": 3,
+    },
+    "timid": {
+        "sword": 1.0, "fight_statue": 0.0, "food": 1.0, "dagger": 1.0, "potion": 1.0, "potion_below": 10,
+        "fight_princess": 0.5, "fight_creatures": 0.5, "max_encounters": 3,
+    },
+    "random": {
+        "sword": 0.5, "fight_statue": 0.5, "food": 0.5, "dagger": 0.5, "potion": 0.5, "potion_below": 10,
+        "fight_princess": 0.5, "fight_creatures": 0.5, "max_encounters": 3,
+    },
+}
+
+# Outcomes of a playthrough
+RUNNING, WON, DIED, GAVE_UP = 0, 1, 2, 3
+OUTCOMES = {WON: "won", DIED: "died", GAVE_UP: "gave_up"}
+
+# Where a player died
+NOWHERE, STATUE, PRINCESS, CREATURES = 0, 1, 2, 3
+KILLERS = {STATUE: "statue", PRINCESS: "princess", CREATURES: "creatures"}
+
+CHUNK_SIZE = 1 << 20  # Rows simulated at once, to keep memory bounded
+
+
+def draw_choices(strategy, runs, rng):
+    """Roll every choice each playthrough will make, up front, as boolean arrays."""
+    encounters = strategy["max_encounters"]
+    return {
+        "sword": rng.random(runs) < strategy["sword"],
+        "fight_statue": rng.random(runs) < strategy["fight_statue"],
+        "food": rng.random(runs) < strategy["food"],
+        "dagger": rng.random(runs) < strategy["dagger"],
+        "potion": rng.random(runs) < strategy["potion"],
+        "fight_princess": rng.random((encounters, runs)) < strategy["fight_princess"],
+        "fight_creatures": rng.random((encounters, runs)) < strategy["fight_creatures"],
+    }
+
+
+def simulate_choices(choices, strategy, params=None):
+    """
+    Play out already-drawn choices, all rows at once.
+    Returns (outcome, health, killer) arrays with one entry per playthrough.
+    """
+    params = {**DEFAULT_PARAMS, **(params or {})}
+    runs = len(choices["sword"])
+    health = np.full(runs, params["start_health"], dtype=np.int32)
+    outcome = np.full(runs, RUNNING, dtype=np.int8)
+    killer = np.full(runs, NOWHERE, dtype=np.int8)
+
+    def bury(dead, where):
+        outcome[dead] = DIED
+        killer[dead] = where
+
+    # Hidden room: taking the sword wakes the statue. Fleeing costs more and the sword is dropped.
+    sword = choices["sword"].copy()
+    fight = choices["fight_statue"]
+    health -= np.where(sword, np.where(fight, params["statue_fight_damage"], params["statue_flee_damage"]), 0)
+    sword &= fight
+    bury(health <= 0, STATUE)
+
+    # Kitchen and office
+    health += np.where(choices["food"] & (outcome == RUNNING), params["food_heal"], 0)
+    dagger = choices["dagger"]
+    potion = choices["potion"].copy()
+
+    def drink_if_low(active):
+        drink = active & potion & (health <= strategy["potion_below"])
+        health[drink] += params["potion_heal"]
+        potion[drink] = False
+
+    def fight_damage(enemy):
+        return np.where(sword, params[enemy + "_sword_damage"],
+                        np.where(dagger, params[enemy + "_dagger_damage"], params[enemy + "_bare_damage"]))
+
+    # Bedroom: the princess drops the basement key if she's beaten with a weapon
+    basement_key = np.zeros(runs, dtype=bool)
+    princess_damage = fight_damage("princess")
+    for encounter in range(strategy["max_encounters"]):
+        active = (outcome == RUNNING) & ~basement_key
+        drink_if_low(active)
+        fight = choices["fight_princess"][encounter]
+        health -= np.where(active, np.where(fight, princess_damage, params["princess_flee_damage"]), 0)
+        basement_key |= active & fight & (sword | dagger) & (health > 0)
+        bury(active & (health <= 0), PRINCESS)
+    outcome[(outcome == RUNNING) & ~basement_key] = GAVE_UP
+
+    # Basement: beating the creatures (even barehanded) gets the final key. Fleeing
+    # leaves it there: 'take final key' only looks at the last word, "key".
+    final_key = np.zeros(runs, dtype=bool)
+    creatures_damage = fight_damage("creatures")
+    for encounter in range(strategy["max_encounters"]):
+        active = (outcome == RUNNING) & ~final_key
+        drink_if_low(active)
+        fight = choices["fight_creatures"][encounter]
+        health -= np.where(active, np.where(fight, creatures_damage, params["creatures_flee_damage"]), 0)
+        final_key |= active & fight & (health > 0)
+        bury(active & (health <= 0), CREATURES)
+    outcome[(outcome == RUNNING) & ~final_key] = GAVE_UP
+
+    # Everyone still standing walks back to the main door
+    outcome[outcome == RUNNING] = WON
+    return outcome, health, killer
+
+
+def simulate(strategy, runs, params=None, seed=None):
+    """Simulate `runs` playthroughs of a strategy (a dict, or a STRATEGIES name)."""
+    if isinstance(strategy, str):
+        strategy = STRATEGIES[strategy]
+    rng = np.random.default_rng(seed)
+    outcomes, healths, killers = [], [], []
+    for start in range(0, runs, CHUNK_SIZE):
+        choices = draw_choices(strategy, min(CHUNK_SIZE, runs - start), rng)
+        outcome, health, killer = simulate_choices(choices, strategy, params)
+        outcomes.append(outcome)
+        healths.append(health)
+        killers.append(killer)
+    return np.concatenate(outcomes), np.concatenate(healths), np.concatenate(killers)
+
+
+def summarize(outcome, health, killer):
+    """Outcome rates, where players died, and the health winners escape with."""
+    runs = len(outcome)
+    summary = {"runs": runs}
+    for code, name in OUTCOMES.items():
+        summary[name] = float(np.count_nonzero(outcome == code)) / runs if runs else 0.0
+    summary["deaths"] = {
+        name: float(np.count_nonzero(killer == code)) / runs if runs else 0.0
+        for code, name in KILLERS.items()
+    }
+    winners = health[outcome == WON]
+    if len(winners):
+        p10, p50, p90 = np.percentile(winners, [10, 50, 90])
+        summary["winner_health"] = {
+            "mean": float(winners.mean()), "p10": float(p10), "p50": float(p50), "p90": float(p90),
+        }
+    else:
+        summary["winner_health"] = None
+    return summary
+
+
+def sweep(param, values, strategies=None, runs=100_000, params=None, seed=0):
+    """
+    Summarize every strategy for every value of one parameter.
+    Returns a list of rows: {"param", "value", "strategy", **summary}.
+    """
+    strategies = strategies or list(STRATEGIES)
+    rows = []
+    for value in values:
+        swept = {**(params or {}), param: value}
+        for name in strategies:
+            summary = summarize(*simulate(name, runs, swept, seed))
+            rows.append({"param": param, "value": value, "strategy": name, **summary})
+    return rows
+
+
+# ---------------------------------
+# Checking against the real game
+# ---------------------------------
+
+def play_in_engine(choices, strategy, row):
+    """
+    Play one row of drawn choices through a real GameSession, with the game's own
+    numbers. Returns (outcome, health) in the same codes as `simulate_choices`.
+    """
+    from AdventureGame import GameSession
+
+    session = GameSession()
+
+    def send(*lines):
+        for line in lines:
+            if session.game_running:
+                session.feed(line)
+
+    def drink_if_low():
+        if session.player_state.has("potion") and session.player_state.health <= strategy["potion_below"]:
+            send("use potion")
+
+    send("ready")
+    if choices["sword"][row]:
+        send("go", "upstairs", "look book", "go", "secret", "take sword",
+             "fight" if choices["fight_statue"][row] else "flee",
+             "go", "out", "go", "downstairs")
+    send("go", "straight")
+    if choices["food"][row]:
+        send("go", "kitchen", "take food", "go", "back")
+    send("go", "hallway2")
+    if choices["dagger"][row] or choices["potion"][row]:
+        send("go", "office")
+        if choices["dagger"][row]:
+            send("take dagger")
+        if choices["potion"][row]:
+            send("take potion")
+        send("go", "back")
+
+    for encounter in range(strategy["max_encounters"]):
+        if not session.game_running or session.player_state.has_basement_key:
+            break
+        drink_if_low()
+        send("go", "bedroom", "fight" if choices["fight_princess"][encounter][row] else "flee", "go", "back")
+
+    for encounter in range(strategy["max_encounters"]):
+        if (not session.game_running or not session.player_state.has_basement_key
+                or session.player_state.has("final key")):
+            break
+        drink_if_low()
+        send("go", "basement", "fight" if choices["fight_creatures"][encounter][row] else "flee", "go", "up")
+
+    if session.game_running and session.player_state.has("final key"):
+        send("go", "back", "go", "back")
+
+    outcome = {"won": WON, "died": DIED}.get(session.outcome, GAVE_UP)
+    return outcome, session.player_state.health
+
+
+def check_against_engine(strategy, runs=2000, seed=0):
+    """
+    Simulate a few playthroughs both ways and return the rows where the simulator
+    and the game disagree (an empty list means the simulator is faithful).
+    """
+    if isinstance(strategy, str):
+        strategy = STRATEGIES[strategy]
+    choices = draw_choices(strategy, runs, np.random.default_rng(seed))
+    outcome, health, _ = simulate_choices(choices, strategy)
+    mismatches = []
+    for row in range(runs):
+        expected = (int(outcome[row]), int(health[row]))
+        actual = play_in_engine(choices, strategy, row)
+        if expected != actual:
+            mismatches.append({"row": row, "simulated": expected, "game": actual})
+    return mismatches
+
+
+def _parse_sweep(text):
+    param, _, values = text.partition("=")
+    if param not in DEFAULT_PARAMS:
+        raise argparse.ArgumentTypeError(f"unknown parameter {param!r}")
+    return param, [int(value) for value in values.split(",") if value]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate Castle Escape combat and healing balance.")
+    parser.add_argument("--runs", type=int, default=1_000_000, help="playthroughs per strategy and value")
+    parser.add_argument("--strategy", action="append", choices=list(STRATEGIES),
+                        help="strategy to simulate (repeatable, default: all)")
+    parser.add_argument("--set", action="append", default=[], metavar="PARAM=VALUE",
+                        help="change a number from DEFAULT_PARAMS")
+    parser.add_argument("--sweep", type=_parse_sweep, metavar="PARAM=V1,V2,...",
+                        help="try every value of one parameter")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the results as JSON lines")
+    parser.add_argument("--check", action="store_true",
+                        help="check the simulator against the real game instead")
+    args = parser.parse_args()
+    strategies = args.strategy or list(STRATEGIES)
+
+    if args.check:
+        for name in strategies:
+            mismatches = check_against_engine(name, seed=args.seed)
+            print(f"{name}: {len(mismatches)} mismatches")
+            for mismatch in mismatches[:5]:
+                print("   ", mismatch)
+        return
+
+    params = {}
+    for setting in args.set:
+        param, values = _parse_sweep(setting)
+        params[param] = values[0]
+    param, values = args.sweep or ("start_health", [params.get("start_health", DEFAULT_PARAMS["start_health"])])
+
+    for row in sweep(param, values, strategies, args.runs, params, args.seed):
+        if args.json:
+            print(json.dumps(row))
+        else:
+            deaths = ", ".join(f"{name} {rate:.1%}" for name, rate in row["deaths"].items())
+            print(f"{row['param']}={row['value']:<4} {row['strategy']:<10} won {row['won']:6.1%}"
+                  f"  died {row['died']:6.1%}  gave up {row['gave_up']:6.1%}  ({deaths})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+# ---------------------------------
+# Benchmarks
+# ---------------------------------
+
+# Measures how fast the engine is, in numbers that can be compared from one
+# commit to the next:
+# - latency (p50 / p99 / mean) of every command path: look, look book, take,
+#   use potion, go along each exit and each fight/flee branch of every enemy
+# - throughput of whole playthroughs (the winning path and a few deaths), played
+#   through TranscriptRunner, so playthroughs/s is the runner's transcripts/s for
+#   full games
+# - memory used per live session, fresh and in the middle of a game
+#
+# Every latency case starts from a saved session (see SessionStore.py), so each
+# run times just the command itself against exactly the same state.
+#
+# From the command line:
+#     python Benchmark.py --output before.json
+#     ... change things ...
+#     python Benchmark.py --compare before.json
+#     python Benchmark.py --large-world 10000   # the castle plus 10000 extra rooms
+
+import argparse
+import gc
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from AdventureGame import ENTRANCE_PATHS, GameSession, World, as_world, rooms
+from SessionStore import pack_session, restore_session
+from TranscriptRunner import run_transcript
+
+DEFAULT_REPEAT = 2000          # Timed runs per latency case
+DEFAULT_DURATION = 1.0         # Seconds per throughput case
+DEFAULT_LIVE_SESSIONS = 2000   # Sessions kept alive to measure memory
+REGRESSION_THRESHOLD = 0.10    # --compare flags anything 10% worse than before
+
+# How to get to each room of the castle from the start
+ROUTES = {
+    "entrance_choice": ["ready"],
+    "library": ["ready", "go", "upstairs"],
+    "hidden_room": ["ready", "go", "upstairs", "look book", "go", "secret"],
+    "hallway": ["ready", "go", "straight"],
+    "kitchen": ["ready", "go", "straight", "go", "kitchen"],
+    "ballroom": ["ready", "go", "straight", "go", "ballroom"],
+    "hallway2": ["ready", "go", "straight", "go", "hallway2"],
+    "office": ["ready", "go", "straight", "go", "hallway2", "go", "office"],
+}
+WITH_SWORD = ROUTES["hidden_room"] + ["take sword", "fight", "go", "out", "go", "downstairs",
+                                     "go", "straight", "go", "hallway2"]
+WITH_DAGGER = ROUTES["office"] + ["take dagger", "go", "back"]
+ROUTES["bedroom"] = WITH_DAGGER + ["go", "bedroom", "fight"]
+ROUTES["basement"] = ROUTES["bedroom"] + ["go", "back", "go", "basement", "fight"]
+
+WINNING_PATH = ROUTES["basement"] + ["go", "up", "go", "back", "go", "back"]
+
+# Whole games for the throughput cases
+PLAYTHROUGHS = {
+    "win_dagger": WINNING_PATH,
+    "win_sword": WITH_SWORD + ["go", "bedroom", "fight", "go", "back", "go", "basement", "fight",
+                               "go", "up", "go", "back", "go", "back"],
+    "die_princess": ROUTES["hallway2"] + ["go", "bedroom", "fight", "go", "back", "go", "bedroom", "fight"],
+    "die_statue_then_princess": ROUTES["hidden_room"] + ["take sword", "flee", "go", "out", "go", "downstairs",
+                                                         "go", "straight", "go", "hallway2", "go", "bedroom",
+                                                         "fight"],
+}
+
+
+def _no_weapons(session):
+    session.player_state.inventory = 0
+
+
+def latency_cases(world=None):
+    """
+    Every command path to time, as {name: (setup commands, timed commands, edit)}.
+    `edit` (or None) adjusts the session after setup, for states the castle can't
+    reach by playing, like facing the basement creatures barehanded.
+    """
+    world = as_world(world)
+    cases = {
+        "look": (ROUTES["entrance_choice"], ["look"], None),
+        "look_book": (ROUTES["library"], ["look book"], None),
+        "look_item": (ROUTES["office"], ["look dagger"], None),
+        "take_food": (ROUTES["kitchen"], ["take food"], None),
+        "take_dagger": (ROUTES["office"], ["take dagger"], None),
+        "take_missing": (ROUTES["hallway"], ["take unicorn"], None),
+        "use_potion": (ROUTES["office"] + ["take potion"], ["use potion"], None),
+        "invalid": (ROUTES["entrance_choice"], ["dance"], None),
+        # Combat, from the "fight or flee?" prompt
+        "statue_fight": (ROUTES["hidden_room"] + ["take sword"], ["fight"], None),
+        "statue_flee": (ROUTES["hidden_room"] + ["take sword"], ["flee"], None),
+        "princess_sword": (WITH_SWORD + ["go", "bedroom"], ["fight"], None),
+        "princess_dagger": (WITH_DAGGER + ["go", "bedroom"], ["fight"], None),
+        "princess_bare": (ROUTES["hallway2"] + ["go", "bedroom"], ["fight"], None),
+        "princess_flee": (ROUTES["hallway2"] + ["go", "bedroom"], ["flee"], None),
+        "creatures_sword": (WITH_SWORD + ["go", "bedroom", "fight", "go", "back", "go", "basement"], ["fight"], None),
+        "creatures_dagger": (ROUTES["bedroom"] + ["go", "back", "go", "basement"], ["fight"], None),
+        "creatures_bare": (ROUTES["bedroom"] + ["go", "back", "go", "basement"], ["fight"], _no_weapons),
+        "creatures_flee": (ROUTES["bedroom"] + ["go", "back", "go", "basement"], ["flee"], None),
+    }
+
+    # 'go' along every exit of every room we know how to reach
+    for room_id, route in ROUTES.items():
+        session = play(route, world)
+        if room_id == "entrance_choice":
+            exits = ENTRANCE_PATHS
+        else:
+            exits = session.room_state(room_id).exits
+        for direction in exits:
+            cases[f"go_{room_id}_{direction}"] = (route, ["go", direction], None)
+    return cases
+
+
+def play(commands, world=None):
+    session = GameSession(world)
+    for line in commands:
+        session.feed(line)
+    session.flush()
+    return session
+
+
+def _percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def time_case(setup, commands, edit=None, world=None, repeat=DEFAULT_REPEAT):
+    """Time `commands` from the state `setup` leads to. Returns latency stats in microseconds."""
+    world = as_world(world)
+    start = play(setup, world)
+    if edit is not None:
+        edit(start)
+    snapshot = pack_session(start)
+
+    timings = []
+    clock = time.perf_counter_ns
+    for _ in range(repeat):
+        session = restore_session(snapshot, world)
+        feed = session.feed
+        began = clock()
+        for line in commands:
+            feed(line)
+        session.flush()
+        timings.append(clock() - began)
+
+    timings.sort()
+    return {
+        "p50_us": _percentile(timings, 0.50) / 1000,
+        "p99_us": _percentile(timings, 0.99) / 1000,
+        "mean_us": sum(timings) / len(timings) / 1000,
+        "runs": repeat,
+    }
+
+
+def measure_throughput(commands, world=None, duration=DEFAULT_DURATION):
+    """Play one transcript over and over with `run_transcript` for about `duration` seconds."""
+    world = as_world(world)
+    games = 0
+    clock = time.perf_counter
+    began = clock()
+    deadline = began + duration
+    while clock() < deadline:
+        result = run_transcript(commands, world)
+        games += 1
+    elapsed = clock() - began
+    return {
+        "playthroughs_per_s": games / elapsed,
+        "commands_per_s": games * result["steps"] / elapsed,
+        "outcome": result["outcome"],
+    }
+
+
+def measure_memory(commands, world=None, count=DEFAULT_LIVE_SESSIONS):
+    """Average bytes held per live session after playing `commands`."""
+    world = as_world(world)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    sessions = [play(commands, world) for _ in range(count)]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del sessions
+    return {"bytes_per_session": used / count, "sessions": count}
+
+
+def large_world(extra_rooms):
+    """
+    The castle plus a corridor of `extra_rooms` more rooms, branching off the
+    hallway, each with an item to take. The benchmark cases then run at its far end.
+    """
+    big = dict(rooms)
+    previous = "hallway"
+    big["hallway"] = {**rooms["hallway"], "exits": {**rooms["hallway"]["exits"], "wing": "wing_0"}}
+    for number in range(extra_rooms):
+        room_id = f"wing_{number}"
+        exits = {"back": previous}
+        if number + 1 < extra_rooms:
+            exits["on"] = f"wing_{number + 1}"
+        big[room_id] = {
+            "description": f"Room {number} of a very long wing of the castle.",
+            "items": [f"trinket{number}"],
+            "exits": exits,
+            "locked": False,
+            "enemy": None,
+            "triggers": {},
+        }
+    return World(big)
+
+
+def large_world_cases(extra_rooms):
+    """Latency cases for the far end of `large_world()` (walked there a room at a time)."""
+    route = ROUTES["hallway"] + ["go", "wing"]
+    for _ in range(extra_rooms - 1):
+        route += ["go", "on"]
+    last = f"wing_{extra_rooms - 1}"
+    return {
+        "look": (route, ["look"], None),
+        f"take_{last}_item": (route, [f"take trinket{extra_rooms - 1}"], None),
+        "take_missing": (route, ["take unicorn"], None),
+        "go_back": (route, ["go", "back"], None),
+    }, route
+
+
+def run_benchmarks(repeat=DEFAULT_REPEAT, duration=DEFAULT_DURATION, sessions=DEFAULT_LIVE_SESSIONS,
+                   extra_rooms=0):
+    """Run everything and return the results as one JSON-ready dict."""
+    if extra_rooms:
+        world = large_world(extra_rooms)
+        cases, deep_route = large_world_cases(extra_rooms)
+        playthroughs = {"walk_wing": deep_route, **PLAYTHROUGHS}
+    else:
+        world = as_world()
+        cases = latency_cases(world)
+        playthroughs = PLAYTHROUGHS
+
+    results = {
+        "meta": {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "rooms": len(world),
+            "repeat": repeat,
+        },
+        "latency": {},
+        "throughput": {},
+        "memory": {},
+    }
+    for name, (setup, commands, edit) in cases.items():
+        results["latency"][name] = time_case(setup, commands, edit, world, repeat)
+    for name, commands in playthroughs.items():
+        results["throughput"][name] = measure_throughput(commands, world, duration)
+    results["memory"]["fresh"] = measure_memory([], world, sessions)
+    results["memory"]["mid_game"] = measure_memory(ROUTES["bedroom"], world, sessions)
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Which way is better for each number we report
+_LOWER_IS_BETTER = {"p50_us", "p99_us", "mean_us", "bytes_per_session"}
+_HIGHER_IS_BETTER = {"playthroughs_per_s", "commands_per_s"}
+
+
+def compare(before, after, threshold=REGRESSION_THRESHOLD):
+    """
+    Compare two results dicts. Returns rows of (metric, before, after, change)
+    where change > 0 means worse, and the list of rows worse than `threshold`.
+    """
+    rows = []
+    for section in ("latency", "throughput", "memory"):
+        for case, stats in after.get(section, {}).items():
+            old_stats = before.get(section, {}).get(case)
+            if old_stats is None:
+                continue
+            for key, value in stats.items():
+                old = old_stats.get(key)
+                if not old or not isinstance(value, (int, float)):
+                    continue
+                if key in _LOWER_IS_BETTER:
+                    change = value / old - 1
+                elif key in _HIGHER_IS_BETTER:
+                    change = old / value - 1
+                else:
+                    continue
+                rows.append((f"{section}.{case}.{key}", old, value, change))
+    regressions = [row for row in rows if row[3] > threshold]
+    return rows, regressions
+
+
+def _print_results(results):
+    meta = results["meta"]
+    print(f"commit {meta['commit']}, Python {meta['python']}, {meta['rooms']} rooms")
+    print("\nlatency (us)                          p50       p99      mean")
+    for name, stats in results["latency"].items():
+        print(f"  {name:<32} {stats['p50_us']:8.2f}  {stats['p99_us']:8.2f}  {stats['mean_us']:8.2f}")
+    print("\nthroughput                     playthroughs/s   commands/s  outcome")
+    for name, stats in results["throughput"].items():
+        print(f"  {name:<28} {stats['playthroughs_per_s']:14,.0f} {stats['commands_per_s']:12,.0f}"
+              f"  {stats['outcome']}")
+    print("\nmemory")
+    for name, stats in results["memory"].items():
+        print(f"  {name:<28} {stats['bytes_per_session']:10,.0f} bytes/session")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Castle Escape engine.")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="timed runs per latency case")
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION,
+                        help="seconds per throughput case")
+    parser.add_argument("--sessions", type=int, default=DEFAULT_LIVE_SESSIONS,
+                        help="live sessions to measure memory with")
+    parser.add_argument("--large-world", type=int, default=0, metavar="ROOMS",
+                        help="benchmark a castle with this many extra rooms")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="compare with an earlier results file; exits with 1 on a regression")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.repeat, args.duration, args.sessions, args.large_world)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        _print_results(results)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        rows, regressions = compare(baseline, results, args.threshold)
+        print(f"\ncompared with {baseline['meta'].get('commit')}: {len(rows)} numbers,"
+              f" {len(regressions)} worse by more than {args.threshold:.0%}")
+        for metric, old, new, change in regressions:
+            print(f"  {metric:<48} {old:12.2f} -> {new:12.2f}  ({change:+.0%})")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
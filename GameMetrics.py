@@ -0,0 +1,306 @@
+# ---------------------------------
+# Metrics
+# ---------------------------------
+
+# Counts and times what the game does, to see in production which rules fire,
+# how often and how long they take. Set a Metrics as `session.metrics` (see
+# `attach_metrics`) and it gets told about:
+# - every command, by kind (look, take, go, fight, ...): a counter and a latency histogram
+# - every rule that fires: a counter and a timer, per rule (see Rule.name)
+# - the watchers (victory, defeat, ...) that run after a command: a counter and a timer each
+# - every room the player walks into: a counter
+# - every game that ends: outcome and room, and how long it lasted
+#
+# One Metrics is meant to be shared by all the sessions of a process. Its counters
+# are allocated up front, and with `sample_every=N` only one command in N (and the
+# rules and checks it runs) is timed, while the counters still see everything.
+#
+# Read it with `snapshot()` (a dict) or `prometheus_text()`, or serve both over
+# HTTP on a local port with `serve_metrics()`:
+#     curl localhost:9100/metrics
+#     curl localhost:9100/metrics.json
+
+import asyncio
+import json
+import time
+from bisect import bisect_left
+
+from AdventureGame import rule_book, watch_list
+
+# Commands are counted by kind: the verbs `run_command` knows, and the answers to prompts
+COMMAND_KINDS = {
+    "look": "look", "inspect": "look",
+    "take": "take", "pick": "take",
+    "use": "use",
+    "go": "go", "move": "go", "path": "go",
+    "quit": "quit", "exit": "quit",
+    "hint": "hint",
+}
+
+# Histogram bucket upper bounds
+LATENCY_BUCKETS = (0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.001, 0.01, 0.1)  # seconds
+LIFETIME_BUCKETS = (10, 30, 60, 300, 900, 1800, 3600)                                    # seconds
+
+
+class Histogram:
+    """Counts of observations per bucket (upper bounds), plus their sum."""
+
+    __slots__ = ("bounds", "counts", "total", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # The last bucket is +Inf
+        self.total = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def as_dict(self):
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(list(self.bounds) + ["+Inf"], self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {"buckets": buckets, "sum": self.total, "count": self.count}
+
+
+class Metrics:
+    """Counters, timers and histograms for the sessions it is attached to."""
+
+    def __init__(self, rules=None, sample_every=1, clock=time.perf_counter_ns):
+        rules = (rules or rule_book).rules
+        self.sample_every = max(1, sample_every)
+        self.clock = clock
+        self.timing = True  # Whether the command being played is one of the sampled ones
+
+        self.commands = 0
+        # "over" counts the lines a client still sends after its game ended
+        self.command_counts = {kind: 0 for kind in ("ready", "path", "fight", "flee", "invalid", "over",
+                                                     *COMMAND_KINDS.values())}
+        self.command_latency = {kind: Histogram(LATENCY_BUCKETS) for kind in self.command_counts}
+
+        # Indexed by Rule.order
+        self.rule_names = [rule.name for rule in rules]
+        self.rule_counts = [0] * len(rules)
+        self.rule_time_ns = [0] * len(rules)
+        self.rule_timed = [0] * len(rules)
+
+        # Indexed by Watcher.order
+        self.watcher_names = [watcher.name for watcher in watch_list.watchers]
+        self.watcher_counts = [0] * len(self.watcher_names)
+        self.watcher_time_ns = [0] * len(self.watcher_names)
+        self.watcher_timed = [0] * len(self.watcher_names)
+
+        self.room_visits = {}
+        self.sessions_started = 0
+        self.sessions_ended = {}  # (outcome, room) -> count
+        self.session_seconds = Histogram(LIFETIME_BUCKETS)
+        self.gauges = {}          # Anything else worth showing, set by whoever owns it
+
+    # --- Hooks the game calls ---
+
+    def session_started(self, session):
+        session.started = time.monotonic()
+        self.sessions_started += 1
+
+    def command_started(self):
+        self.commands += 1
+        self.timing = self.commands % self.sample_every == 0
+        return self.clock() if self.timing else 0
+
+    def command_finished(self, pending, line, began):
+        if pending == "command":
+            kind = COMMAND_KINDS.get(line.partition(" ")[0], "invalid")
+        elif pending == "combat":
+            kind = "fight" if line == "fight" else "flee"
+        else:
+            kind = pending
+        self.command_counts[kind] += 1
+        if self.timing:
+            self.command_latency[kind].observe((self.clock() - began) / 1e9)
+
+    def fire_rule(self, rule, session, room_id, item):
+        order = rule.order
+        self.rule_counts[order] += 1
+        if not self.timing:
+            rule.fire(session, room_id, item)
+            return
+        began = self.clock()
+        rule.fire(session, room_id, item)
+        self.rule_time_ns[order] += self.clock() - began
+        self.rule_timed[order] += 1
+
+    def check_end_conditions(self, session):
+        watch_list.run(session, self)
+
+    def run_watcher(self, watcher, session):
+        order = watcher.order
+        self.watcher_counts[order] += 1
+        if not self.timing:
+            watcher.run(session)
+            return
+        began = self.clock()
+        watcher.run(session)
+        self.watcher_time_ns[order] += self.clock() - began
+        self.watcher_timed[order] += 1
+
+    def room_visited(self, room_id):
+        self.room_visits[room_id] = self.room_visits.get(room_id, 0) + 1
+
+    def session_ended(self, session):
+        """Called by `end_game`, and by servers for games that were left unfinished."""
+        if session.started is None:
+            return  # Already counted
+        key = (session.outcome or "abandoned", session.player_state.current_room)
+        self.sessions_ended[key] = self.sessions_ended.get(key, 0) + 1
+        self.session_seconds.observe(time.monotonic() - session.started)
+        session.started = None
+
+    def session_dropped(self, session):
+        """Forget a game that never really started (e.g. replaced by a resumed one)."""
+        if session.started is not None:
+            session.started = None
+            self.sessions_started -= 1
+
+    # --- Reading the numbers ---
+
+    def snapshot(self):
+        """All the numbers as a plain, JSON-ready dict."""
+        rules = {}
+        for order, name in enumerate(self.rule_names):
+            if self.rule_counts[order]:
+                timed = self.rule_timed[order]
+                rules[name] = {
+                    "fired": self.rule_counts[order],
+                    "timed": timed,
+                    "mean_seconds": self.rule_time_ns[order] / timed / 1e9 if timed else None,
+                }
+        return {
+            "sample_every": self.sample_every,
+            "commands": dict(self.command_counts),
+            "command_latency_seconds": {kind: histogram.as_dict()
+                                        for kind, histogram in self.command_latency.items() if histogram.count},
+            "rules": rules,
+            "watchers": {
+                name: {
+                    "ran": self.watcher_counts[order],
+                    "timed": self.watcher_timed[order],
+                    "mean_seconds": (self.watcher_time_ns[order] / self.watcher_timed[order] / 1e9
+                                     if self.watcher_timed[order] else None),
+                }
+                for order, name in enumerate(self.watcher_names)
+            },
+            "room_visits": dict(self.room_visits),
+            "sessions": {
+                "started": self.sessions_started,
+                "ended": [{"outcome": outcome, "room": room, "count": count}
+                          for (outcome, room), count in self.sessions_ended.items()],
+                "lifetime_seconds": self.session_seconds.as_dict(),
+            },
+            "gauges": dict(self.gauges),
+        }
+
+    def prometheus_text(self):
+        """All the numbers in the Prometheus text exposition format."""
+        lines = []
+
+        def metric(name, kind, help_text):
+            lines.append(f"# HELP castle_{name} {help_text}")
+            lines.append(f"# TYPE castle_{name} {kind}")
+
+        def histogram(name, labels, data):
+            prefix = labels + "," if labels else ""
+            for bound, count in data.as_dict()["buckets"].items():
+                lines.append(f'castle_{name}_bucket{{{prefix}le="{bound}"}} {count}')
+            braces = f"{{{labels}}}" if labels else ""
+            lines.append(f"castle_{name}_sum{braces} {data.total}")
+            lines.append(f"castle_{name}_count{braces} {data.count}")
+
+        metric("commands_total", "counter", "Commands played, by kind.")
+        for kind, count in self.command_counts.items():
+            lines.append(f'castle_commands_total{{command="{kind}"}} {count}')
+
+        metric("command_seconds", "histogram", "Time to play a command (sampled).")
+        for kind, data in self.command_latency.items():
+            if data.count:
+                histogram("command_seconds", f'command="{kind}"', data)
+
+        metric("rule_fired_total", "counter", "Times each rule fired.")
+        metric("rule_seconds_sum", "counter", "Time spent firing each rule (sampled).")
+        metric("rule_seconds_count", "counter", "Rule firings that were timed.")
+        for order, name in enumerate(self.rule_names):
+            if self.rule_counts[order]:
+                label = f'rule="{_escape(name)}"'
+                lines.append(f"castle_rule_fired_total{{{label}}} {self.rule_counts[order]}")
+                lines.append(f"castle_rule_seconds_sum{{{label}}} {self.rule_time_ns[order] / 1e9}")
+                lines.append(f"castle_rule_seconds_count{{{label}}} {self.rule_timed[order]}")
+
+        metric("watcher_runs_total", "counter", "Times each watcher (victory, defeat, ...) ran.")
+        metric("watcher_seconds_sum", "counter", "Time spent running each watcher (sampled).")
+        metric("watcher_seconds_count", "counter", "Watcher runs that were timed.")
+        for order, name in enumerate(self.watcher_names):
+            label = f'watcher="{_escape(name)}"'
+            lines.append(f"castle_watcher_runs_total{{{label}}} {self.watcher_counts[order]}")
+            lines.append(f"castle_watcher_seconds_sum{{{label}}} {self.watcher_time_ns[order] / 1e9}")
+            lines.append(f"castle_watcher_seconds_count{{{label}}} {self.watcher_timed[order]}")
+
+        metric("room_visits_total", "counter", "Times players walked into each room.")
+        for room_id, count in self.room_visits.items():
+            lines.append(f'castle_room_visits_total{{room="{_escape(room_id)}"}} {count}')
+
+        metric("sessions_started_total", "counter", "Games started.")
+        lines.append(f"castle_sessions_started_total {self.sessions_started}")
+        metric("sessions_ended_total", "counter", "Games ended, by outcome and the room they ended in.")
+        for (outcome, room_id), count in self.sessions_ended.items():
+            lines.append(f'castle_sessions_ended_total{{outcome="{outcome}",room="{_escape(room_id)}"}} {count}')
+        metric("session_lifetime_seconds", "histogram", "How long games lasted.")
+        histogram("session_lifetime_seconds", "", self.session_seconds)
+
+        for name, value in self.gauges.items():
+            metric(name, "gauge", name.replace("_", " ").capitalize() + ".")
+            lines.append(f"castle_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(text):
+    return text.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def attach_metrics(session, metrics):
+    """Start counting a session's commands and rules in `metrics`."""
+    session.metrics = metrics
+    metrics.session_started(session)
+    return metrics
+
+
+async def serve_metrics(metrics, host="127.0.0.1", port=9100):
+    """
+    Serve `metrics` over HTTP: /metrics in Prometheus text format, /metrics.json
+    as a snapshot. Meant for a local port only. Returns the asyncio server.
+    """
+    async def handle(reader, writer):
+        try:
+            request = await reader.readline()
+            while (await reader.readline()).strip():
+                pass  # Skip the headers
+            parts = request.decode("latin-1").split()
+            path = parts[1] if len(parts) > 1 else "/"
+            if path == "/metrics":
+                status, content_type, body = "200 OK", "text/plain; version=0.0.4", metrics.prometheus_text()
+            elif path == "/metrics.json":
+                status, content_type, body = "200 OK", "application/json", json.dumps(metrics.snapshot())
+            else:
+                status, content_type, body = "404 Not Found", "text/plain", "Try /metrics or /metrics.json\n"
+            data = body.encode("utf-8")
+            writer.write(f"HTTP/1.0 {status}\r\nContent-Type: {content_type}\r\n"
+                         f"Content-Length: {len(data)}\r\n\r\n".encode("latin-1") + data)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
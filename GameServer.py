@@ -0,0 +1,287 @@
+# ---------------------------------
+# Castle Escape network server
+# ---------------------------------
+
+# Hosts many Castle Escape games in one process over a plain TCP line protocol:
+# the client sends one command per line, the server answers with the game's output
+# followed by the next prompt (e.g. "> "), just like the terminal version.
+#
+# Try it on your own machine with:
+#     python GameServer.py --port 4000
+#     nc localhost 4000
+
+import argparse
+import asyncio
+import logging
+import secrets
+
+from AdventureGame import GameSession, INTRO_TEXT
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 4000
+DEFAULT_MAX_SESSIONS = 1000
+DEFAULT_IDLE_TIMEOUT = 300.0   # Seconds a player can sit at a prompt before we hang up
+MAX_LINE_LENGTH = 1024         # Longest command we accept from a client
+HINT_TIME_BUDGET = 0.05        # Seconds a 'hint' searches for at a time, before the other players get a turn
+WRITE_BUFFER_HIGH = 64 * 1024  # Pause the game for a client once this much output is waiting
+
+log = logging.getLogger(__name__)
+
+
+class GameServer:
+    """
+    Runs one GameSession per connected client, all on a single asyncio event loop.
+    - Each session only moves forward when its client sends a line, so an idle
+      player costs no thread and no CPU.
+    - After every answer we wait for the client's socket to drain, so a slow reader
+      can't make us buffer unlimited output for them.
+    - Players that don't send anything for `idle_timeout` seconds are disconnected.
+    - At most `max_sessions` games run at once; extra clients are told the server
+      is full and disconnected.
+    - With a SessionStore, a game that is left (or times out) is saved and taken
+      out of memory, and the player can 'resume <game id>' it on a new connection.
+    - With a JournalWriter, every game's events are journaled under its game id,
+      and the journal is flushed on a timer so quiet periods still get written.
+    - With a Metrics, every game's commands and rules are counted and timed.
+    - A line is played as soon as it arrives, not batched with other players'
+      (a ';'-separated line is one request already). Turns are only batched on
+      the way to another process, by GameSupervisor's workers.
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, max_sessions=DEFAULT_MAX_SESSIONS,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT, session_factory=GameSession, store=None, journal=None,
+                 metrics=None):
+        self.host = host
+        self.port = port
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.session_factory = session_factory
+        self.store = store
+        self.journal = journal
+        self.metrics = metrics
+        self.active_sessions = 0
+        self.live_ids = set()  # Ids of the games being played on a connection right now
+        self.unsaved = {}      # Session id -> a game left that the store couldn't take
+        self.server = None
+        self.flush_task = None
+
+    async def start(self):
+        """Start listening. Returns once the socket is bound (useful for tests with port=0)."""
+        self.server = await asyncio.start_server(
+            self.handle_client, self.host, self.port, limit=MAX_LINE_LENGTH
+        )
+        # If we were asked for port 0, remember which port the OS actually gave us
+        self.port = self.server.sockets[0].getsockname()[1]
+        if self.journal is not None:
+            self.flush_task = asyncio.create_task(self._flush_journal())
+        return self.server
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        if self.journal is not None:
+            self.journal.flush()
+
+    async def _flush_journal(self):
+        while True:
+            await asyncio.sleep(self.journal.commit_interval)
+            self.journal.flush()
+
+    async def handle_client(self, reader, writer):
+        """Play one game with one connected client."""
+        if self.active_sessions >= self.max_sessions:
+            writer.write(b"Sorry, the castle is full right now. Please try again later.\n")
+            await self._close_writer(writer)
+            return
+
+        self.active_sessions += 1
+        self._update_gauges()
+        session = session_id = None
+        try:
+            writer.transport.set_write_buffer_limits(high=WRITE_BUFFER_HIGH)
+            session = self.session_factory()
+            session.world.planner.time_budget = HINT_TIME_BUDGET
+            self._measure(session)
+            prompt = session.prompt
+            greeting = INTRO_TEXT
+            if self.store is not None or self.journal is not None:
+                session_id = secrets.token_hex(8)
+                self.live_ids.add(session_id)
+                self._journal(session, session_id)
+            if self.store is not None:
+                greeting += (f"Your game id is {session_id}. If you get disconnected, connect"
+                             f" again and type 'resume {session_id}' to carry on.\n")
+            await self._send(writer, greeting + prompt)
+
+            first_line = True
+            while prompt is not None:
+                line = await self._read_line(reader, writer)
+                if line is None:
+                    break
+                if first_line and self.store is not None and line.lower().startswith("resume "):
+                    session, session_id, output = self._resume(session, session_id, line.split()[-1])
+                    prompt = session.prompt
+                    await self._send(writer, output + prompt)
+                    continue
+                first_line = False
+                output, prompt = session.step(line)
+                await self._send(writer, output + (prompt or ""))
+                while session.thinking:
+                    # A hint that ran out of time goes on between everyone else's commands
+                    await asyncio.sleep(0)
+                    session.think()
+                    output = session.flush()
+                    if output:
+                        await self._send(writer, output + prompt)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass  # The client went away; nothing left to tell them
+        finally:
+            self.active_sessions -= 1
+            self._update_gauges()
+            if self.metrics is not None and session is not None:
+                self.metrics.session_ended(session)  # Counted as abandoned if unfinished
+            if session_id is not None:
+                self.live_ids.discard(session_id)
+                self._put_away(session_id, session)
+            await self._close_writer(writer)
+
+    def _resume(self, session, session_id, saved_id):
+        """Swap in a saved game. Returns (session, session id, text for the player)."""
+        if saved_id in self.live_ids:
+            return session, session_id, "That game is being played on another connection.\n"
+        saved = self.unsaved.pop(saved_id, None) or self.store.load(saved_id)
+        if saved is None:
+            return session, session_id, "There's no saved game with that id.\n"
+        # The game is this connection's now: nobody else can resume it until it's put away again
+        self.store.delete(saved_id)
+        self.live_ids.discard(session_id)
+        self.live_ids.add(saved_id)
+        self._journal(saved, saved_id)
+        if self.metrics is not None:
+            self.metrics.session_dropped(session)
+        self._measure(saved)
+        saved.describe_current_room()
+        return saved, saved_id, "Welcome back!\n" + saved.flush()
+
+    def _journal(self, session, session_id):
+        if self.journal is not None:
+            from SessionJournal import attach_journal
+            attach_journal(session, self.journal, session_id)
+
+    def _measure(self, session):
+        if self.metrics is not None:
+            from GameMetrics import attach_metrics
+            attach_metrics(session, self.metrics)
+
+    def _update_gauges(self):
+        if self.metrics is not None:
+            self.metrics.gauges["active_sessions"] = self.active_sessions
+
+    def _put_away(self, session_id, session):
+        """Save an unfinished game so it can be resumed, and forget finished ones."""
+        if self.store is None:
+            return
+        if session.game_running:
+            try:
+                self.store.save(session_id, session)
+            except (ValueError, OSError):
+                # Keep it in memory instead: it can still be resumed until the server stops
+                log.exception("Couldn't save game %s", session_id)
+                self.unsaved[session_id] = session
+        else:
+            self.store.delete(session_id)
+
+    async def _read_line(self, reader, writer):
+        """Wait for the next command. Returns None if the client left or went idle."""
+        try:
+            data = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+        except asyncio.TimeoutError:
+            await self._send(writer, "\nYou have been idle for too long. Goodbye!\n")
+            return None
+        except ValueError:
+            # asyncio raises this (as LimitOverrunError) for lines longer than the limit
+            await self._send(writer, "\nThat command is too long. Goodbye!\n")
+            return None
+        if not data:
+            return None  # EOF
+        return data.decode("utf-8", errors="replace")
+
+    async def _send(self, writer, text):
+        # drain() only waits when the write buffer is over the high-water mark,
+        # which is how a slow reader holds back its own session and nobody else's.
+        writer.write(text.encode("utf-8"))
+        await writer.drain()
+
+    async def _close_writer(self, writer):
+        try:
+            writer.close()
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Host Castle Escape games over TCP.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--max-sessions", type=int, default=DEFAULT_MAX_SESSIONS,
+                        help="how many games can run at the same time")
+    parser.add_argument("--idle-timeout", type=float, default=DEFAULT_IDLE_TIMEOUT,
+                        help="seconds before an idle player is disconnected")
+    parser.add_argument("--store", help="file to save unfinished games in, so players can resume them")
+    parser.add_argument("--journal", help="file to journal every game's events in, for crash recovery")
+    parser.add_argument("--metrics-port", type=int,
+                        help="serve metrics on this local port (/metrics and /metrics.json)")
+    parser.add_argument("--metrics-sample", type=int, default=1,
+                        help="time only one command in this many (counters still see them all)")
+    parser.add_argument("--shared", action="store_true",
+                        help="put every player in the same castle (see SharedWorld.py)")
+    args = parser.parse_args()
+    if args.shared and (args.store or args.journal or args.metrics_port is not None):
+        parser.error("--shared games can't be saved, journaled or measured")
+
+    session_factory = GameSession
+    if args.shared:
+        from SharedWorld import SharedCastle
+        session_factory = SharedCastle().new_session
+
+    store = None
+    if args.store:
+        from SessionStore import SessionStore
+        store = SessionStore(args.store)
+    journal = None
+    if args.journal:
+        from SessionJournal import JournalWriter
+        journal = JournalWriter(args.journal)
+    metrics = None
+    if args.metrics_port is not None:
+        from GameMetrics import Metrics
+        metrics = Metrics(sample_every=args.metrics_sample)
+
+    server = GameServer(args.host, args.port, args.max_sessions, args.idle_timeout, session_factory,
+                        store=store, journal=journal, metrics=metrics)
+
+    async def run():
+        if metrics is not None:
+            from GameMetrics import serve_metrics
+            await serve_metrics(metrics, port=args.metrics_port)
+        await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,843 @@
+# ---------------------------------
+# Multi-core game supervisor
+# ---------------------------------
+
+# One Python process only ever uses one core for the games, however many
+# sessions it holds. The supervisor spreads the games over several worker
+# processes on the same machine:
+# - It accepts the players' connections itself (same line protocol as
+#   GameServer) and hands every command to the worker that owns the session.
+# - A new session goes to a worker picked from its id (rendezvous hashing), and
+#   then stays there: its state only ever lives in that one worker.
+# - Every worker journals its sessions (see SessionJournal.py) and keeps the games
+#   players left in its own SessionStore. If a worker dies, the surviving workers
+#   rebuild its sessions from its journal, the players carry on where they were,
+#   and a fresh worker takes its place. A worker compacts its journal whenever it
+#   has doubled in size, so a dead worker's journal is only ever read from its
+#   last compaction.
+# - The world's read-only data (descriptions, the exit graph, enemy templates) is
+#   put in shared memory once by the supervisor. Workers map it read-only and only
+#   decode the rooms their players actually walk into.
+#
+# Everything runs on one Linux machine (the shared world is a file in /dev/shm):
+#     python GameSupervisor.py --workers 4 --port 4000
+#     nc localhost 4000
+#     python GameSupervisor.py --check    # kill a worker mid-game and play on
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import marshal
+import mmap
+import multiprocessing
+import os
+import secrets
+import shutil
+import signal
+import struct
+import tempfile
+from array import array
+from collections.abc import Mapping, Sequence
+from multiprocessing.shared_memory import SharedMemory
+
+from AdventureGame import INTRO_TEXT, RULES, GameSession, RoomState, World, castle, item_names, items_mask
+from GameServer import (
+    DEFAULT_HOST, DEFAULT_IDLE_TIMEOUT, DEFAULT_MAX_SESSIONS, DEFAULT_PORT, HINT_TIME_BUDGET, WRITE_BUFFER_HIGH,
+    GameServer,
+)
+from SessionJournal import JournalWriter, attach_journal, recover_sessions
+from SessionStore import OVERFLOW_SUFFIX, SessionStore
+
+DEFAULT_WORKERS = os.cpu_count() or 1
+SHARED_MAGIC = b"CESW"
+_SHARED_HEADER = struct.Struct("<4sI")  # magic, size of the marshalled layout that follows
+READ_SIZE = 64 * 1024
+JOURNAL_COMPACT_SIZE = 16 * 1024 * 1024  # Bytes of journal before a worker first compacts it
+HICCUP = "(The castle shook for a moment. If nothing happened, please try that again.)\n"
+FAILED = "Sorry, something went wrong with that command.\n"
+
+log = logging.getLogger(__name__)
+
+
+# --- The world in shared memory ---
+
+def share_world(world):
+    """
+    Copy a World's read-only data into a new shared memory block: the exit
+    arrays and locked rooms as they are, the rooms' starting items by name,
+    every room as its own marshalled record so it can be decoded alone, and
+    the world's rules. Returns the SharedMemory; whoever made it unlinks it.
+    """
+    room_offsets = array("Q", [0])
+    records = []
+    for room_id in world.room_ids:
+        records.append(marshal.dumps(world.rooms[room_id]))
+        room_offsets.append(room_offsets[-1] + len(records[-1]))
+    names = [name.encode("utf-8") for name in world.exit_names]
+    name_offsets = array("Q", [0])
+    for name in names:
+        name_offsets.append(name_offsets[-1] + len(name))
+    item_rooms = {world.room_index[room_id]: item_names(items) for room_id, items in world.item_rooms.items()}
+    sections = [
+        ("exit_starts", world.exit_starts.tobytes()),
+        ("exit_targets", world.exit_targets.tobytes()),
+        ("locked_rooms", world.locked_rooms.tobytes()),
+        ("item_rooms", marshal.dumps(item_rooms)),
+        ("room_offsets", room_offsets.tobytes()),
+        ("rooms", b"".join(records)),
+        ("name_offsets", name_offsets.tobytes()),
+        ("names", b"".join(names)),
+    ]
+
+    layout = {"room_ids": world.room_ids, "rules": None if world.rules is RULES else world.rules, "sections": {}}
+    offset = 0
+    for name, data in sections:
+        layout["sections"][name] = (offset, len(data))
+        offset += -(-len(data) // 8) * 8  # Keep every section 8-byte aligned
+    layout_data = marshal.dumps(layout)
+    base = -(-(_SHARED_HEADER.size + len(layout_data)) // 8) * 8
+
+    block = SharedMemory(create=True, size=base + offset)
+    _SHARED_HEADER.pack_into(block.buf, 0, SHARED_MAGIC, len(layout_data))
+    block.buf[_SHARED_HEADER.size:_SHARED_HEADER.size + len(layout_data)] = layout_data
+    for name, data in sections:
+        start = base + layout["sections"][name][0]
+        block.buf[start:start + len(data)] = data
+    return block
+
+
+class SharedRooms(Mapping):
+    """The `rooms` dict of a shared world: each room is decoded the first time it's asked for."""
+
+    def __init__(self, buffer, room_ids, room_index, offsets):
+        self.buffer = buffer
+        self.room_ids = room_ids
+        self.room_index = room_index
+        self.offsets = offsets
+        self.decoded = {}
+
+    def __getitem__(self, room_id):
+        room = self.decoded.get(room_id)
+        if room is None:
+            index = self.room_index[room_id]
+            room = self.decoded[room_id] = marshal.loads(self.buffer[self.offsets[index]:self.offsets[index + 1]])
+        return room
+
+    def __iter__(self):
+        return iter(self.room_ids)
+
+    def __len__(self):
+        return len(self.room_ids)
+
+    def __contains__(self, room_id):
+        return room_id in self.room_index
+
+
+class SharedStartStates(Mapping):
+    """`World.start_states` for shared rooms, made (once) when a room is first used."""
+
+    def __init__(self, rooms):
+        self.rooms = rooms
+        self.states = {}
+
+    def __getitem__(self, room_id):
+        state = self.states.get(room_id)
+        if state is None:
+            state = self.states[room_id] = RoomState.from_room(self.rooms[room_id])
+        return state
+
+    def __iter__(self):
+        return iter(self.rooms)
+
+    def __len__(self):
+        return len(self.rooms)
+
+
+class SharedNames(Sequence):
+    """`World.exit_names`, read from the shared block on demand."""
+
+    def __init__(self, buffer, offsets):
+        self.buffer = buffer
+        self.offsets = offsets
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[position] for position in range(*index.indices(len(self)))]
+        return bytes(self.buffer[self.offsets[index]:self.offsets[index + 1]]).decode("utf-8")
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+
+def attach_world(name):
+    """
+    A World over a block made by `share_world()`, mapped read-only. Only the
+    room ids and the rooms' starting items are copied into this process; rooms
+    are decoded as they're used.
+    """
+    with open(os.path.join("/dev/shm", name.lstrip("/")), "rb") as block_file:
+        block = mmap.mmap(block_file.fileno(), 0, prot=mmap.PROT_READ)
+    buffer = memoryview(block)
+    magic, layout_size = _SHARED_HEADER.unpack_from(buffer, 0)
+    if magic != SHARED_MAGIC:
+        raise ValueError(f"Shared memory block {name!r} isn't a shared world")
+    layout = marshal.loads(buffer[_SHARED_HEADER.size:_SHARED_HEADER.size + layout_size])
+    base = -(-(_SHARED_HEADER.size + layout_size) // 8) * 8
+
+    def section(section_name, item_format):
+        start, size = layout["sections"][section_name]
+        view = buffer[base + start:base + start + size]
+        return view.cast(item_format) if item_format else view
+
+    room_ids = layout["room_ids"]
+    room_index = {room_id: index for index, room_id in enumerate(room_ids)}
+    rooms = SharedRooms(section("rooms", None), room_ids, room_index, section("room_offsets", "Q"))
+    names = SharedNames(section("names", None), section("name_offsets", "Q"))
+    item_rooms = {room_ids[index]: items_mask(items)
+                  for index, items in marshal.loads(section("item_rooms", None)).items()}
+    return World(rooms, SharedStartStates(rooms), (section("exit_starts", "I"), section("exit_targets", "I"), names),
+                 (section("locked_rooms", "I"), item_rooms), layout["rules"])
+
+
+# --- Workers ---
+
+class ShardWorker:
+    """
+    The games of one worker process. It talks to the supervisor over one Unix
+    socket, in JSON lines: a request {"seq", "op", "id", ...} gets a reply
+    {"seq", ...}. Every batch of requests is journaled before any of its replies
+    go out, so whatever a player has been told survives the worker dying.
+    """
+
+    def __init__(self, world, journal_path, store_path, compact_size=JOURNAL_COMPACT_SIZE):
+        self.world = world
+        world.planner.time_budget = HINT_TIME_BUDGET
+        self.sessions = {}  # session id -> GameSession, for the players connected right now
+        self.journal = JournalWriter(journal_path)
+        self.compact_size = compact_size
+        self.compact_at = compact_size  # Twice the size after the last compaction, so it costs O(1) per record
+        self.store = SessionStore(store_path, world)
+        self.operations = {
+            "open": self.open,
+            "turns": self.turns,
+            "close": self.close,
+            "resume": self.resume,
+            "adopt": self.adopt,
+            "think": self.think,
+        }
+
+    async def serve(self, control_path, slot, generation):
+        reader, writer = await asyncio.open_unix_connection(control_path)
+        writer.write(json.dumps({"slot": slot, "generation": generation}).encode("utf-8") + b"\n")
+        unfinished = b""
+        while True:
+            data = await reader.read(READ_SIZE)
+            if not data:
+                break  # The supervisor is gone, so we go too
+            lines = (unfinished + data).split(b"\n")
+            unfinished = lines.pop()
+            replies = []
+            for line in lines:
+                request = json.loads(line)
+                try:
+                    reply = self.operations[request["op"]](request)
+                except Exception as error:
+                    # One bad request mustn't take every game in this worker down with it
+                    log.exception("Worker request %s failed", request["op"])
+                    reply = {"error": f"{type(error).__name__}: {error}"}
+                reply["seq"] = request["seq"]
+                replies.append(json.dumps(reply, separators=(",", ":")).encode("utf-8") + b"\n")
+            self.commit()  # The whole batch is on disk before anyone hears about it
+            writer.write(b"".join(replies))
+            await writer.drain()
+        self.journal.close()
+        self.store.close()
+
+    def commit(self):
+        """Write a batch's journal records together (group commit), compacting the journal once it has doubled."""
+        self.journal.flush()
+        if self.journal.size >= self.compact_at:
+            self.journal.compact(self.world)
+            self.compact_at = max(self.compact_size, 2 * self.journal.size)
+
+    def open(self, request):
+        session = GameSession(self.world)
+        attach_journal(session, self.journal, request["id"])
+        self.sessions[request["id"]] = session
+        return {"prompt": session.prompt}
+
+    def turns(self, request):
+        """A line for each of many sessions, in one request: {"turns": [[id, line], ...]}."""
+        results = []
+        for session_id, line in request["turns"]:
+            try:
+                results.append(self.play(session_id, line))
+            except Exception as error:
+                log.exception("Game %s failed on %r", session_id, line)
+                results.append({"error": f"{type(error).__name__}: {error}"})
+        return {"results": results}
+
+    def play(self, session_id, line):
+        session = self.sessions.get(session_id)
+        if session is None:
+            return {"output": "Sorry, your game has been lost.\n", "prompt": None}
+        output, prompt = session.step(line)
+        if prompt is None:
+            del self.sessions[session_id]
+        if session.thinking:
+            return {"output": output, "prompt": prompt, "thinking": True}
+        return {"output": output, "prompt": prompt}
+
+    def think(self, request):
+        """Go on with a hint that ran out of time (the supervisor asks again until it's given)."""
+        session = self.sessions.get(request["id"])
+        if session is None:
+            return {"output": "", "thinking": False}
+        session.think()
+        return {"output": session.flush(), "thinking": session.thinking}
+
+    def close(self, request):
+        """The player left: put the game away so it can be resumed."""
+        session = self.sessions.get(request["id"])
+        if session is not None and session.game_running:
+            self.store.save(request["id"], session)  # If this fails the game stays in memory
+        self.sessions.pop(request["id"], None)
+        return {}
+
+    def resume(self, request):
+        session = self.sessions.get(request["id"])  # A game the store couldn't take
+        if session is None:
+            session = self.store.load(request["id"])
+            if session is None:
+                return {"output": None}
+            self.store.delete(request["id"])
+            attach_journal(session, self.journal, request["id"])
+        self.sessions[request["id"]] = session
+        session.describe_current_room()
+        return {"output": "Welcome back!\n" + session.flush(), "prompt": session.prompt}
+
+    def adopt(self, request):
+        """
+        Take over a dead worker's sessions, rebuilt from its journal: the `live`
+        ones (players still connected) into memory, the `parked` ones into the store.
+        Finished games are left out.
+        """
+        live = set(request["live"])
+        recovered = recover_sessions(request["journal"], self.world, request["live"] + request["parked"])
+        prompts = {}
+        parked = []
+        for session_id, session in recovered.items():
+            if not session.game_running:
+                continue
+            attach_journal(session, self.journal, session_id)
+            if session_id in live:
+                self.sessions[session_id] = session
+                prompts[session_id] = session.prompt
+            else:
+                try:
+                    self.store.save(session_id, session)
+                except (ValueError, OSError):
+                    log.exception("Couldn't save adopted game %s; keeping it in memory", session_id)
+                    self.sessions[session_id] = session
+                parked.append(session_id)
+        return {"prompts": prompts, "parked": parked}
+
+
+def run_worker(slot, generation, control_path, world_name, journal_path, store_path):
+    """The body of a worker process."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C is for the supervisor to handle
+    world = attach_world(world_name)
+    asyncio.run(ShardWorker(world, journal_path, store_path).serve(control_path, slot, generation))
+
+
+class WorkerLost(Exception):
+    """The worker handling a request died before answering it (or there's no worker at all)."""
+
+
+class WorkerError(Exception):
+    """The worker couldn't carry out a request, and said why."""
+
+
+class WorkerLink:
+    """
+    The supervisor's end of one worker: its process, its socket and its
+    unanswered requests. Players' lines aren't sent one by one: the ones that
+    come in during one pass of the event loop go to the worker as a single
+    "turns" request, so a busy worker gets one message (and one journal flush)
+    for many players instead of one each.
+    """
+
+    def __init__(self, slot, generation, process, journal_path, store_path):
+        self.slot = slot
+        self.generation = generation
+        self.process = process
+        self.journal_path = journal_path
+        self.store_path = store_path
+        self.reader = None
+        self.writer = None
+        self.alive = False
+        self.ready = asyncio.get_running_loop().create_future()
+        self.waiting = {}  # seq -> future for the reply
+        self.next_seq = 0
+        self.turns = []    # (request, future) for the "line" requests waiting to go out together
+
+    async def call(self, request):
+        """Send a request and wait for the reply. Raises WorkerLost if the worker dies first."""
+        if request["op"] == "line":
+            future = asyncio.get_running_loop().create_future()
+            if not self.turns:
+                asyncio.get_running_loop().call_soon(self._send_turns)
+            self.turns.append((request, future))
+        else:
+            future = self._send(request)
+        try:
+            await self.writer.drain()
+        except ConnectionError:
+            pass  # `read_replies` sees the worker go and fails the future
+        return await future
+
+    def _send(self, request):
+        """Write a request (without waiting); returns the future for its reply."""
+        future = asyncio.get_running_loop().create_future()
+        if not self.alive:
+            future.set_exception(WorkerLost(self.slot))
+            return future
+        self.next_seq += 1
+        request["seq"] = self.next_seq
+        self.waiting[self.next_seq] = future
+        try:
+            self.writer.write(json.dumps(request, separators=(",", ":")).encode("utf-8") + b"\n")
+        except ConnectionError:
+            pass
+        return future
+
+    def _send_turns(self):
+        turns, self.turns = self.turns, []
+        batch = self._send({"op": "turns", "turns": [[request["id"], request["line"]] for request, _ in turns]})
+
+        def answer(batch):
+            error = batch.exception()
+            results = [None] * len(turns) if error else batch.result()["results"]
+            for (_, future), result in zip(turns, results):
+                if future.done():
+                    continue
+                if error:
+                    future.set_exception(error)
+                elif "error" in result:
+                    future.set_exception(WorkerError(result["error"]))
+                else:
+                    future.set_result(result)
+
+        batch.add_done_callback(answer)
+
+    async def read_replies(self):
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                reply = json.loads(line)
+                future = self.waiting.pop(reply["seq"], None)
+                if future is None or future.done():
+                    continue
+                if "error" in reply:
+                    future.set_exception(WorkerError(reply["error"]))
+                else:
+                    future.set_result(reply)
+        except ConnectionError:
+            pass
+        self.alive = False
+        for future in self.waiting.values():
+            if not future.done():
+                future.set_exception(WorkerLost(self.slot))
+        self.waiting.clear()
+
+
+# --- The supervisor ---
+
+class GameSupervisor(GameServer):
+    """
+    A GameServer whose games are played in `workers` worker processes.
+    `owners` maps every unfinished session (connected, or left to be resumed) to
+    its worker, and only changes when a worker dies and its sessions move.
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, workers=DEFAULT_WORKERS,
+                 max_sessions=DEFAULT_MAX_SESSIONS, idle_timeout=DEFAULT_IDLE_TIMEOUT, world=None, run_dir=None,
+                 start_timeout=30.0):
+        super().__init__(host, port, max_sessions, idle_timeout)
+        self.worker_count = workers
+        self.world = castle if world is None else world
+        self.run_dir = run_dir
+        self.start_timeout = start_timeout
+        self.shared_world = None
+        self.control_server = None
+        self.control_path = None
+        self.closing = False
+        self.links = [None] * workers
+        self.owners = {}          # session id -> WorkerLink
+        self.connected = set()    # Session ids with a player connected right now
+        self.recovering = {}      # dead WorkerLink -> Event set once its sessions have moved
+        self.link_tasks = set()   # The tasks reading each worker's replies
+        self.adopted_prompts = {}  # session id -> its prompt, for a request lost with its worker
+        self.context = multiprocessing.get_context("spawn")  # Workers start clean, without our memory
+
+    async def start(self):
+        if self.run_dir is None:
+            self.run_dir = tempfile.mkdtemp(prefix="castle-")
+        os.makedirs(self.run_dir, exist_ok=True)
+        self.shared_world = share_world(self.world)
+        self.control_path = os.path.join(self.run_dir, "control.sock")
+        if os.path.exists(self.control_path):
+            os.unlink(self.control_path)
+        self.control_server = await asyncio.start_unix_server(self._worker_connected, self.control_path)
+        await asyncio.gather(*(self._spawn(slot, 0) for slot in range(self.worker_count)))
+        return await super().start()
+
+    async def close(self):
+        self.closing = True
+        await super().close()
+        for link in self.links:
+            if link is not None and link.writer is not None:
+                link.writer.close()  # A worker exits once its socket is closed
+        if self.link_tasks:
+            # They end once their worker has hung up (or, for a worker still
+            # starting, once it has connected and been sent away)
+            await asyncio.wait(self.link_tasks, timeout=self.start_timeout)
+        loop = asyncio.get_running_loop()
+        for link in self.links:
+            if link is not None:
+                await loop.run_in_executor(None, link.process.join, 5)
+        if self.control_server is not None:
+            self.control_server.close()
+            await self.control_server.wait_closed()
+        if self.shared_world is not None:
+            self.shared_world.close()
+            self.shared_world.unlink()
+            self.shared_world = None
+
+    # --- Workers ---
+
+    async def _spawn(self, slot, generation):
+        name = f"worker-{slot}.{generation}"
+        journal_path = os.path.join(self.run_dir, name + ".journal")
+        store_path = os.path.join(self.run_dir, name + ".sessions")
+        process = self.context.Process(
+            target=run_worker, daemon=True, name=name,
+            args=(slot, generation, self.control_path, self.shared_world.name, journal_path, store_path),
+        )
+        link = self.links[slot] = WorkerLink(slot, generation, process, journal_path, store_path)
+        process.start()
+        await asyncio.wait_for(link.ready, self.start_timeout)
+        return link
+
+    async def _worker_connected(self, reader, writer):
+        task = asyncio.current_task()
+        self.link_tasks.add(task)
+        try:
+            hello = json.loads(await reader.readline())
+            link = self.links[hello["slot"]]
+            if link is None or link.generation != hello["generation"]:
+                writer.close()
+                return
+            if self.closing:
+                writer.close()  # Too late: it exits straight away
+                link.ready.set_result(None)
+                return
+            link.reader, link.writer, link.alive = reader, writer, True
+            link.ready.set_result(None)
+            await link.read_replies()
+            if not self.closing:
+                await self._worker_died(link)
+        except WorkerLost:
+            if not self.closing:
+                raise  # Another worker died while taking this one's sessions
+        finally:
+            self.link_tasks.discard(task)
+
+    async def _worker_died(self, link):
+        """Move a dead worker's sessions to the live ones, then start a new worker in its place."""
+        recovered = self.recovering[link] = asyncio.Event()
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, link.process.join, 5)
+            orphans = [session_id for session_id, owner in self.owners.items() if owner is link]
+            if not self._live_links():
+                await self._spawn(link.slot, link.generation + 1)
+
+            moves = {}
+            for session_id in orphans:
+                moves.setdefault(self.route(session_id), []).append(session_id)
+            for new_owner, session_ids in moves.items():
+                reply = await new_owner.call({
+                    "op": "adopt", "journal": link.journal_path,
+                    "live": [session_id for session_id in session_ids if session_id in self.connected],
+                    "parked": [session_id for session_id in session_ids if session_id not in self.connected],
+                })
+                kept = set(reply["parked"]) | set(reply["prompts"])
+                for session_id in session_ids:
+                    if session_id in kept:
+                        self.owners[session_id] = new_owner
+                    else:
+                        self.owners.pop(session_id, None)  # Its game was over
+                self.adopted_prompts.update(reply["prompts"])
+        finally:
+            recovered.set()
+            del self.recovering[link]
+
+        for path in (link.journal_path, link.store_path, link.store_path + ".items.json"):
+            if os.path.exists(path):
+                os.unlink(path)
+        shutil.rmtree(link.store_path + OVERFLOW_SUFFIX, ignore_errors=True)
+        if self.links[link.slot] is link and not self.closing:
+            await self._spawn(link.slot, link.generation + 1)
+
+    def _live_links(self):
+        return [link for link in self.links if link is not None and link.alive]
+
+    def route(self, session_id):
+        """
+        The live worker a new session goes to: the one that scores highest for its id.
+        Raises WorkerLost if no worker is up right now.
+        """
+        def score(link):
+            return hashlib.blake2b(f"{link.slot}:{session_id}".encode("utf-8"), digest_size=8).digest()
+        links = self._live_links()
+        if not links:
+            raise WorkerLost(None)
+        return max(links, key=score)
+
+    async def _moved(self, session_id, link):
+        """Wait until a session of a dead worker has moved to another one (or ended)."""
+        while self.owners.get(session_id) is link:
+            event = self.recovering.get(link)
+            if event is None:
+                await asyncio.sleep(0.01)  # Its death hasn't been noticed yet
+            else:
+                await event.wait()
+
+    async def _call(self, session_id, request):
+        """
+        Send a request about a session to whichever worker has it. A request that
+        never reached a dead worker is sent again once the session has moved; one
+        that was lost with it raises WorkerLost.
+        """
+        request["id"] = session_id
+        while True:
+            link = self.owners.get(session_id)
+            if link is None:
+                raise WorkerLost(None)
+            if link.alive:
+                try:
+                    return await link.call(request)
+                except WorkerLost:
+                    await self._moved(session_id, link)
+                    raise
+            await self._moved(session_id, link)
+
+    # --- Players ---
+
+    async def handle_client(self, reader, writer):
+        """Play one game with one connected client, in whichever worker owns it."""
+        if self.active_sessions >= self.max_sessions:
+            writer.write(b"Sorry, the castle is full right now. Please try again later.\n")
+            await self._close_writer(writer)
+            return
+
+        self.active_sessions += 1
+        session_id = secrets.token_hex(8)
+        try:
+            writer.transport.set_write_buffer_limits(high=WRITE_BUFFER_HIGH)
+            try:
+                self.owners[session_id] = self.route(session_id)
+                self.connected.add(session_id)
+                prompt = (await self._call(session_id, {"op": "open"}))["prompt"]
+            except (WorkerLost, WorkerError):
+                self.owners.pop(session_id, None)
+                await self._send(writer, "Sorry, the castle can't start a new game right now."
+                                         " Please try again later.\n")
+                return
+            await self._send(writer, INTRO_TEXT + f"Your game id is {session_id}. If you get disconnected, connect"
+                                     f" again and type 'resume {session_id}' to carry on.\n" + prompt)
+
+            first_line = True
+            while prompt is not None:
+                line = await self._read_line(reader, writer)
+                if line is None:
+                    break
+                if first_line and line.lower().startswith("resume "):
+                    session_id, output, prompt = await self._resume(session_id, line.split()[-1], prompt)
+                    await self._send(writer, output + prompt)
+                    continue
+                first_line = False
+                try:
+                    reply = await self._call(session_id, {"op": "line", "line": line})
+                except WorkerLost:
+                    # We can't know whether the command was played before the worker died
+                    prompt = self.adopted_prompts.pop(session_id, None)
+                    await self._send(writer, HICCUP + (prompt or ""))
+                    continue
+                except WorkerError:
+                    await self._send(writer, FAILED + prompt)
+                    continue
+                prompt = reply["prompt"]
+                await self._send(writer, reply["output"] + (prompt or ""))
+                while reply.get("thinking"):
+                    # Every "think" is another message in the worker's queue, so its
+                    # other players' commands get in between
+                    try:
+                        reply = await self._call(session_id, {"op": "think"})
+                    except (WorkerLost, WorkerError):
+                        break  # They can always ask again
+                    if reply["output"]:
+                        await self._send(writer, reply["output"] + prompt)
+            if prompt is None:
+                self.owners.pop(session_id, None)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.active_sessions -= 1
+            self.connected.discard(session_id)
+            self.adopted_prompts.pop(session_id, None)
+            if session_id in self.owners and not self.closing:
+                try:
+                    await self._call(session_id, {"op": "close"})
+                except (WorkerLost, WorkerError):
+                    pass  # The worker that has it (now) keeps it in memory
+            await self._close_writer(writer)
+
+    async def _resume(self, session_id, saved_id, prompt):
+        """Swap the fresh game for a saved one. Returns (session id, text for the player, prompt)."""
+        if saved_id in self.connected:
+            return session_id, "That game is being played on another connection.\n", prompt
+        if saved_id not in self.owners:
+            return session_id, "There's no saved game with that id.\n", prompt
+        self.connected.add(saved_id)
+        try:
+            reply = await self._call(saved_id, {"op": "resume"})
+        except (WorkerLost, WorkerError):
+            reply = {"output": None}
+        if reply["output"] is None:
+            self.connected.discard(saved_id)
+            return session_id, "There's no saved game with that id.\n", prompt
+        try:
+            await self._call(session_id, {"op": "close"})
+        except (WorkerLost, WorkerError):
+            pass
+        self.owners.pop(session_id, None)
+        self.connected.discard(session_id)
+        return saved_id, reply["output"], reply["prompt"]
+
+
+# --- Trying it out ---
+
+async def _read_answer(reader):
+    """Read what the server says up to its next prompt (or until it hangs up)."""
+    text = ""
+    while not text.endswith("> "):
+        data = await reader.read(READ_SIZE)
+        if not data:
+            break
+        text += data.decode("utf-8")
+    return text
+
+
+async def check(workers):
+    """
+    Play a game through a supervisor, kill the worker that has it halfway, and
+    finish the game on the worker it moves to. Also leaves and resumes a game.
+    """
+    run_dir = tempfile.TemporaryDirectory(prefix="castle-check-")
+    supervisor = GameSupervisor(port=0, workers=workers, run_dir=run_dir.name)
+    await supervisor.start()
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", supervisor.port)
+        greeting = await _read_answer(reader)
+        session_id = greeting.split("Your game id is ")[1].split(".")[0]
+
+        async def play(lines):
+            text = ""
+            for line in lines:
+                writer.write(line.encode("utf-8") + b"\n")
+                text = await _read_answer(reader)
+                if HICCUP in text:
+                    print(f"  '{line}' was lost with the worker; playing it again")
+                    writer.write(line.encode("utf-8") + b"\n")
+                    text = await _read_answer(reader)
+            return text
+
+        await play(["ready", "go", "straight", "go", "hallway2", "go", "office", "take dagger"])
+        victim = supervisor.owners[session_id]
+        print(f"Game {session_id} is in worker {victim.slot} (pid {victim.process.pid}); killing it")
+        os.kill(victim.process.pid, signal.SIGKILL)
+        await play(["go"])
+        print(f"  the game moved to worker {supervisor.owners[session_id].slot}")
+        text = await play(["back; go; bedroom; fight; go; back; go; basement; fight; go; up; go; back; go; back"])
+        won = "Congratulations, you win!" in text
+        print("  finished the game after the worker died:", "won" if won else "NOT WON")
+        writer.close()
+
+        # Leave a game halfway and pick it up on a new connection
+        reader, writer = await asyncio.open_connection("127.0.0.1", supervisor.port)
+        greeting = await _read_answer(reader)
+        saved_id = greeting.split("Your game id is ")[1].split(".")[0]
+        writer.write(b"ready\ngo\n")
+        await _read_answer(reader)
+        writer.write(b"upstairs\n")
+        await _read_answer(reader)
+        writer.close()
+        await asyncio.sleep(0.1)
+        reader, writer = await asyncio.open_connection("127.0.0.1", supervisor.port)
+        await _read_answer(reader)
+        writer.write(f"resume {saved_id}\n".encode("utf-8"))
+        text = await _read_answer(reader)
+        resumed = "Welcome back!" in text and "grand library" in text
+        print("  resumed a game left in the library:", "yes" if resumed else "NO")
+        writer.close()
+        return won and resumed
+    finally:
+        await supervisor.close()
+        run_dir.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Host Castle Escape games over TCP on several cores.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="worker processes (default: one per core)")
+    parser.add_argument("--max-sessions", type=int, default=DEFAULT_MAX_SESSIONS,
+                        help="how many games can run at the same time")
+    parser.add_argument("--idle-timeout", type=float, default=DEFAULT_IDLE_TIMEOUT,
+                        help="seconds before an idle player is disconnected")
+    parser.add_argument("--world", help="world file to play (see WorldLoader.py) instead of the castle")
+    parser.add_argument("--run-dir", help="directory for the workers' journals and saved games")
+    parser.add_argument("--check", action="store_true",
+                        help="kill a worker in the middle of a game and check the game carries on")
+    args = parser.parse_args()
+
+    if args.check:
+        ok = asyncio.run(check(max(2, args.workers)))
+        raise SystemExit(0 if ok else 1)
+
+    world = None
+    if args.world:
+        from WorldLoader import load_world
+        world = load_world(args.world)
+    supervisor = GameSupervisor(args.host, args.port, args.workers, args.max_sessions, args.idle_timeout,
+                                world, args.run_dir)
+
+    async def run():
+        try:
+            await supervisor.serve_forever()
+        finally:
+            await supervisor.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+# ---------------------------------
+# Session journal (event sourcing)
+# ---------------------------------
+
+# Every accepted command and every change it makes to the game is appended to a
+# journal as a small event, for example:
+#     ("command", "take sword")
+#     ("pick_up", "hidden_room", "sword")
+#     ("spawn", "hidden_room", {"name": "statue", ...})
+#     ("damage", "bedroom", 5)
+#     ("set_flag", "bedroom", "has_basement_key", True)
+#     ("move", "basement")
+# Every so often a snapshot of the whole session (a SessionStore record) is written
+# too, so after a crash a session is rebuilt from its latest snapshot plus the few
+# events after it, without running the rules again. Compacting a journal (see
+# `JournalWriter.compact`) rewrites it as just the latest snapshot of every
+# unfinished game, so it doesn't grow forever and recovery reads only from there.
+#
+# All the sessions of a worker share one journal file. Records are collected in
+# memory and written in batches (group commit), so journaling doesn't cost a
+# system call per command.
+#
+# Snapshots hold items as bitmasks over this process's item ids, which another
+# process (the one recovering the journal) numbers differently. So the journal
+# also carries the item names: an ITEMS record lists the names of the ids from
+# some id on, before the first snapshot that can use them. A writer starts its
+# table again from id 0, so a journal appended to by several processes in turn
+# still reads right.
+
+import json
+import os
+import struct
+import time
+
+from AdventureGame import EFFECTS, ITEM_NAMES, GameSession, as_world, items_mask
+from SessionStore import pack_session, restore_session
+
+EVENT = 1
+SNAPSHOT = 2
+ITEMS = 3  # {"from": first item id, "names": [...]}; not about any one session
+
+# record length (type + id + payload), record type, session id length
+_RECORD_HEADER = struct.Struct("<IBB")
+
+DEFAULT_BATCH_SIZE = 256         # Write once this many records are waiting...
+DEFAULT_COMMIT_INTERVAL = 0.05   # ...or once the oldest waiting record is this old (seconds)
+DEFAULT_SNAPSHOT_EVERY = 200     # Events between snapshots of a session
+
+
+class JournalWriter:
+    """
+    The append-only journal file shared by a worker's sessions.
+    Records wait in a buffer and are written together by `flush()`, which happens
+    automatically when the batch is full or old enough; a server should also call
+    `flush()` on a timer so a quiet period doesn't leave records unwritten.
+    """
+
+    def __init__(self, path, batch_size=DEFAULT_BATCH_SIZE,
+                 commit_interval=DEFAULT_COMMIT_INTERVAL, fsync=False):
+        self.path = path
+        self.batch_size = batch_size
+        self.commit_interval = commit_interval
+        self.fsync = fsync
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self.buffer = []
+        self.waiting = 0    # Records in the buffer
+        self.oldest = None  # When the oldest record in the buffer was added
+        self.items_written = 0  # Item ids whose names are in the journal already
+        self.size = os.fstat(self.fd).st_size  # Bytes in the file, not counting the buffer
+
+    def snapshot(self, session_id, session):
+        """Append a snapshot of a session, after the names of any items it could mention."""
+        if self.items_written < len(ITEM_NAMES):
+            names = ITEM_NAMES[self.items_written:]
+            self.append(ITEMS, "", json.dumps({"from": self.items_written, "names": names}).encode("utf-8"))
+            self.items_written += len(names)
+        self.append(SNAPSHOT, session_id, pack_session(session))
+
+    def append(self, record_type, session_id, payload):
+        key = session_id.encode("utf-8")
+        self.buffer.append(_RECORD_HEADER.pack(1 + 1 + len(key) + len(payload), record_type, len(key)))
+        self.buffer.append(key)
+        self.buffer.append(payload)
+        self.waiting += 1
+        if self.oldest is None:
+            self.oldest = time.monotonic()
+        if (self.waiting >= self.batch_size
+                or time.monotonic() - self.oldest >= self.commit_interval):
+            self.flush()
+
+    def flush(self):
+        """Write every waiting record with one system call."""
+        if not self.buffer:
+            return
+        self.size += os.write(self.fd, b"".join(self.buffer))
+        if self.fsync:
+            os.fsync(self.fd)
+        self.buffer = []
+        self.waiting = 0
+        self.oldest = None
+
+    def compact(self, world=None):
+        """Rewrite the journal as one snapshot per unfinished session (see `compact_journal`) and append to that."""
+        self.flush()
+        os.close(self.fd)
+        self.items_written = compact_journal(self.path, world)
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+        self.size = os.fstat(self.fd).st_size
+
+    def close(self):
+        self.flush()
+        os.close(self.fd)
+
+
+class SessionJournal:
+    """Records one session's events; set it as `session.journal` (see `attach_journal`)."""
+
+    __slots__ = ("writer", "session_id", "snapshot_every", "events_since_snapshot")
+
+    def __init__(self, writer, session_id, snapshot_every=DEFAULT_SNAPSHOT_EVERY):
+        self.writer = writer
+        self.session_id = session_id
+        self.snapshot_every = snapshot_every
+        self.events_since_snapshot = 0
+
+    def record(self, session, event):
+        # Snapshots are only taken between commands, when the state is consistent
+        if event[0] == "command" and self.events_since_snapshot >= self.snapshot_every:
+            self.snapshot(session)
+        self.writer.append(EVENT, self.session_id, json.dumps(event, separators=(",", ":")).encode("utf-8"))
+        self.events_since_snapshot += 1
+
+    def snapshot(self, session):
+        self.writer.snapshot(self.session_id, session)
+        self.events_since_snapshot = 0
+
+
+def attach_journal(session, writer, session_id, snapshot_every=DEFAULT_SNAPSHOT_EVERY):
+    """Start journaling a session. Writes a snapshot first so the journal knows where it starts."""
+    session.journal = SessionJournal(writer, session_id, snapshot_every)
+    session.journal.snapshot(session)
+    return session.journal
+
+
+# ---------------------------------
+# Recovery
+# ---------------------------------
+
+def apply_event(session, event):
+    """Redo one journaled event on a session."""
+    kind = event[0]
+    if kind in EFFECTS:
+        EFFECTS[kind](session, event[1], None, *event[2:])
+    elif kind == "move":
+        session.player_state.current_room = event[1]
+    elif kind == "prompt":
+        session.pending = event[1]
+    elif kind == "end":
+        session.game_running = False
+        if session.outcome is None:
+            session.outcome = event[1]
+    # "command" events are there for the record; their effects follow them
+
+
+def read_journal(path):
+    """Yield (record type, session id, payload) for every complete record in a journal file."""
+    with open(path, "rb") as journal_file:
+        data = journal_file.read()
+    offset = 0
+    header_size = _RECORD_HEADER.size
+    while offset + header_size <= len(data):
+        length, record_type, key_length = _RECORD_HEADER.unpack_from(data, offset)
+        end = offset + 4 + length
+        if end > len(data):
+            break  # A record cut short by a crash; everything before it is fine
+        key_start = offset + header_size
+        session_id = data[key_start:key_start + key_length].decode("utf-8")
+        yield record_type, session_id, data[key_start + key_length:end]
+        offset = end
+
+
+def recover_sessions(path, world=None, session_ids=None):
+    """
+    Rebuild sessions from a journal: each one from its latest snapshot, replaying only
+    the events written after it. Returns {session id: GameSession}.
+    """
+    world = as_world(world)
+    wanted = None if session_ids is None else set(session_ids)
+
+    # First pass: keep only the latest snapshot (with the item names it was
+    # written with) and the events after it
+    tails = {}
+    names = []
+    for record_type, session_id, payload in read_journal(path):
+        if record_type == ITEMS:
+            table = json.loads(payload)
+            if table["from"] == 0:
+                names = []  # A new writer: earlier snapshots keep the table they had
+            del names[table["from"]:]
+            names.extend(table["names"])
+            continue
+        if wanted is not None and session_id not in wanted:
+            continue
+        if record_type == SNAPSHOT:
+            tails[session_id] = [(payload, names)]
+        else:
+            tails.setdefault(session_id, [None]).append(payload)
+
+    sessions = {}
+    for session_id, (snapshot, *events) in tails.items():
+        if snapshot is None:
+            session = GameSession(world)
+        else:
+            payload, names = snapshot
+            session = restore_session(payload, world, lambda mask, names=names: items_mask(
+                names[index] for index in range(mask.bit_length()) if mask >> index & 1))
+        for payload in events:
+            apply_event(session, json.loads(payload))
+        sessions[session_id] = session
+    return sessions
+
+
+def compact_journal(path, world=None):
+    """
+    Rewrite a journal as one snapshot per unfinished session, dropping everything
+    else. Returns how many item names the new journal holds (see JournalWriter.items_written).
+    """
+    sessions = recover_sessions(path, world)
+    temporary_path = path + ".compact"
+    writer = JournalWriter(temporary_path)
+    for session_id, session in sessions.items():
+        if session.game_running:
+            writer.snapshot(session_id, session)
+    writer.close()
+    os.replace(temporary_path, path)
+    return writer.items_written
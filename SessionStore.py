@@ -0,0 +1,399 @@
+# ---------------------------------
+# Saving and restoring sessions
+# ---------------------------------
+
+# A saved game is a small binary record: the player state plus only the rooms
+# that differ from the pristine world, and only the fields of those rooms that
+# changed. A fresh game saves to a couple of dozen bytes.
+#
+# SessionStore keeps these records in fixed-size slots of a memory-mapped file,
+# keyed by session id, so a worker can put an idle session away (evict it from
+# RAM) and bring it back in microseconds when the player reconnects. The rare
+# record too big for a slot (a player who has changed a lot of rooms) goes in a
+# file of its own instead.
+
+import json
+import mmap
+import os
+import struct
+
+from AdventureGame import (
+    ITEM_NAMES, PROMPTS, GameSession, RoomState, as_world, intern_item, item_names, items_mask,
+)
+
+RECORD_VERSION = 2
+PENDINGS = list(PROMPTS)
+OUTCOMES = [None, "won", "died", "quit"]
+
+# version, pending, outcome, health, flag bits, current room index
+_HEADER = struct.Struct("<BBBiBI")
+_HEADER_V1 = struct.Struct("<BBBhBI")  # Version 1 records, from before health had 32 bits
+_U8 = struct.Struct("<B")
+_U16 = struct.Struct("<H")
+_U32 = struct.Struct("<I")
+
+# Which fields of a room a record carries
+_ITEMS, _EXITS, _LOCKED, _ENEMY, _TRIGGERS = 1, 2, 4, 8, 16
+
+
+# --- Packing helpers ---
+
+def _same_mask(mask):
+    return mask
+
+def _pack_str(parts, text):
+    data = text.encode("utf-8")
+    parts.append(_U16.pack(len(data)))
+    parts.append(data)
+
+def _pack_mask(parts, mask):
+    data = mask.to_bytes((mask.bit_length() + 7) // 8, "little")
+    parts.append(_U16.pack(len(data)))
+    parts.append(data)
+
+def _unpack_str(data, offset):
+    (length,) = _U16.unpack_from(data, offset)
+    offset += 2
+    return bytes(data[offset:offset + length]).decode("utf-8"), offset + length
+
+def _unpack_mask(data, offset):
+    (length,) = _U16.unpack_from(data, offset)
+    offset += 2
+    return int.from_bytes(data[offset:offset + length], "little"), offset + length
+
+
+def pack_session(session, convert_mask=None):
+    """
+    Serialize a session to bytes: the player state plus its changes to the world.
+    `convert_mask` can translate item bitmasks to another id numbering.
+    Raises ValueError for a session that doesn't fit the format (a health past
+    32 bits, say, or more than 255 flags).
+    """
+    try:
+        return _pack_session(session, convert_mask or _same_mask)
+    except struct.error as error:
+        raise ValueError(f"Can't save this session: {error}") from error
+
+
+def _pack_session(session, convert_mask):
+    world = session.world
+    player_state = session.player_state
+    flag_bits = (player_state.has_basement_key << 0) | (session.game_running << 1)
+    parts = [_HEADER.pack(
+        RECORD_VERSION,
+        PENDINGS.index(session.pending),
+        OUTCOMES.index(session.outcome),
+        player_state.health,
+        flag_bits,
+        world.room_index[player_state.current_room],
+    )]
+    _pack_mask(parts, convert_mask(player_state.inventory))
+
+    # Any other flags the rules have set
+    flags = player_state.flags or {}
+    parts.append(_U8.pack(len(flags)))
+    for name, value in flags.items():
+        _pack_str(parts, name)
+        parts.append(_U8.pack(bool(value)))
+
+    # Only the rooms, and the fields, that differ from the pristine world
+    changed = []
+    for room_id, state in session.room_changes.items():
+        start = world.start_states[room_id]
+        fields = ((state.items != start.items and _ITEMS)
+                  | (state.exits != start.exits and _EXITS)
+                  | (state.locked != start.locked and _LOCKED)
+                  | (state.enemy != start.enemy and _ENEMY)
+                  | (state.triggers != start.triggers and _TRIGGERS))
+        if fields:
+            changed.append((world.room_index[room_id], fields, state))
+
+    parts.append(_U32.pack(len(changed)))
+    for room_index, fields, state in changed:
+        parts.append(_U32.pack(room_index))
+        parts.append(_U8.pack(fields))
+        if fields & _ITEMS:
+            _pack_mask(parts, convert_mask(state.items))
+        if fields & _EXITS:
+            parts.append(_U16.pack(len(state.exits)))
+            for direction, destination in state.exits.items():
+                _pack_str(parts, direction)
+                _pack_str(parts, destination)
+        if fields & _LOCKED:
+            parts.append(_U8.pack(bool(state.locked)))
+        if fields & _ENEMY:
+            # An empty string means no enemy; spawned enemies are small dicts
+            _pack_str(parts, json.dumps(state.enemy) if state.enemy else "")
+        if fields & _TRIGGERS:
+            parts.append(_U16.pack(len(state.triggers)))
+            for name, value in state.triggers.items():
+                _pack_str(parts, name)
+                parts.append(_U8.pack(bool(value)))
+    return b"".join(parts)
+
+
+def restore_session(data, world=None, convert_mask=None):
+    """Rebuild a GameSession from `pack_session()` bytes (or a memoryview of them)."""
+    world = as_world(world)
+    convert_mask = convert_mask or _same_mask
+    version = data[0]
+    if version == RECORD_VERSION:
+        header = _HEADER
+    elif version == 1:
+        header = _HEADER_V1
+    else:
+        raise ValueError(f"Unsupported session record version: {version}")
+    _, pending, outcome, health, flag_bits, room_index = header.unpack_from(data, 0)
+    offset = header.size
+
+    session = GameSession(world)
+    session.pending = PENDINGS[pending]
+    session.outcome = OUTCOMES[outcome]
+    session.game_running = bool(flag_bits & 2)
+    player_state = session.player_state
+    player_state.current_room = world.room_ids[room_index]
+    player_state.health = health
+    player_state.has_basement_key = bool(flag_bits & 1)
+    inventory, offset = _unpack_mask(data, offset)
+    player_state.inventory = convert_mask(inventory)
+
+    (flag_count,) = _U8.unpack_from(data, offset)
+    offset += 1
+    for _ in range(flag_count):
+        name, offset = _unpack_str(data, offset)
+        player_state[name] = bool(data[offset])
+        offset += 1
+
+    (room_count,) = _U32.unpack_from(data, offset)
+    offset += 4
+    for _ in range(room_count):
+        (room_index,) = _U32.unpack_from(data, offset)
+        fields = data[offset + 4]
+        offset += 5
+        room_id = world.room_ids[room_index]
+        start = world.start_states[room_id]
+        state = RoomState(start.items, start.exits, start.locked, start.enemy, start.triggers)
+        if fields & _ITEMS:
+            items, offset = _unpack_mask(data, offset)
+            state.items = convert_mask(items)
+        if fields & _EXITS:
+            (count,) = _U16.unpack_from(data, offset)
+            offset += 2
+            exits = {}
+            for _ in range(count):
+                direction, offset = _unpack_str(data, offset)
+                exits[direction], offset = _unpack_str(data, offset)
+            state.exits = exits
+        if fields & _LOCKED:
+            state.locked = bool(data[offset])
+            offset += 1
+        if fields & _ENEMY:
+            enemy, offset = _unpack_str(data, offset)
+            state.enemy = json.loads(enemy) if enemy else None
+        if fields & _TRIGGERS:
+            (count,) = _U16.unpack_from(data, offset)
+            offset += 2
+            triggers = {}
+            for _ in range(count):
+                name, offset = _unpack_str(data, offset)
+                triggers[name] = bool(data[offset])
+                offset += 1
+            state.triggers = triggers
+        session.room_changes[room_id] = state
+    return session
+
+
+# ---------------------------------
+# Memory-mapped session store
+# ---------------------------------
+
+# File layout:
+#   header: magic, slot size, slot count
+#   slots:  [session id length (1 byte)][session id (up to 63 bytes)][record length (4 bytes)][record]
+# A record length of 0 means the slot is free, and OVERFLOW that the record is in
+# "<path>.overflow/<session id in hex>". The item names that record bitmasks
+# refer to are kept next to the file in "<path>.items.json", so a store written by
+# one process can be read by another that numbered its items differently.
+
+_FILE_HEADER = struct.Struct("<4sII")
+MAGIC = b"CESS"
+KEY_SIZE = 64
+DEFAULT_SLOT_SIZE = 512
+DEFAULT_CAPACITY = 1024
+OVERFLOW = 0xFFFFFFFF
+OVERFLOW_SUFFIX = ".overflow"
+
+
+class SessionStore:
+    """
+    Saved sessions in fixed-size slots of a memory-mapped file.
+
+        store = SessionStore("sessions.db")
+        store.save("abc123", session)      # or store.evict(...) to also drop it from a cache
+        session = store.load("abc123")     # None if there's no such game
+    """
+
+    def __init__(self, path, world=None, slot_size=DEFAULT_SLOT_SIZE, capacity=DEFAULT_CAPACITY):
+        self.path = path
+        self.world = as_world(world)
+        self.items_path = path + ".items.json"
+        self.overflow_dir = path + OVERFLOW_SUFFIX
+
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            with open(path, "wb") as new_file:
+                new_file.write(_FILE_HEADER.pack(MAGIC, slot_size, capacity))
+                new_file.truncate(_FILE_HEADER.size + slot_size * capacity)
+
+        self.file = open(path, "r+b")
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        magic, self.slot_size, self.capacity = _FILE_HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a session store")
+
+        self._load_item_names()
+
+        # Rebuild the session id -> slot index from the slots themselves
+        self.index = {}
+        self.free_slots = []
+        for slot in range(self.capacity):
+            start = self._slot_offset(slot)
+            key_length = self.map[start]
+            (record_length,) = _U32.unpack_from(self.map, start + KEY_SIZE)
+            if record_length:
+                self.index[bytes(self.map[start + 1:start + 1 + key_length]).decode("utf-8")] = slot
+            else:
+                self.free_slots.append(slot)
+        self.free_slots.reverse()  # Hand out low slots first
+
+    # --- Item ids ---
+
+    def _load_item_names(self):
+        """Line up the store's item ids with this process's ids."""
+        self.stored_item_names = []
+        if os.path.exists(self.items_path):
+            with open(self.items_path) as items_file:
+                self.stored_item_names = json.load(items_file)
+        self.stored_item_index = {name: index for index, name in enumerate(self.stored_item_names)}
+        # Interning the stored names in order gives them the same ids here, unless
+        # this process already gave some of them other ids
+        self.same_ids = all(intern_item(name) == index for index, name in enumerate(self.stored_item_names))
+
+    def _sync_item_names(self):
+        """Make sure every item a record might mention is in the store's item table."""
+        if self.same_ids:
+            new_names = ITEM_NAMES[len(self.stored_item_names):]
+        else:
+            new_names = [name for name in ITEM_NAMES if name not in self.stored_item_index]
+        if new_names:
+            for name in new_names:
+                self.stored_item_index[name] = len(self.stored_item_names)
+                self.stored_item_names.append(name)
+            with open(self.items_path, "w") as items_file:
+                json.dump(self.stored_item_names, items_file)
+
+    def _to_stored(self, mask):
+        stored_index = self.stored_item_index
+        result = 0
+        for name in item_names(mask):
+            result |= 1 << stored_index[name]
+        return result
+
+    def _from_stored(self, mask):
+        names = self.stored_item_names
+        return items_mask(names[index] for index in range(mask.bit_length()) if mask >> index & 1)
+
+    # --- Slots ---
+
+    def _slot_offset(self, slot):
+        return _FILE_HEADER.size + slot * self.slot_size
+
+    def _overflow_path(self, session_id):
+        return os.path.join(self.overflow_dir, session_id.encode("utf-8").hex())
+
+    def _record_length(self, slot):
+        (record_length,) = _U32.unpack_from(self.map, self._slot_offset(slot) + KEY_SIZE)
+        return record_length
+
+    def _grow(self):
+        """Double the number of slots."""
+        old_capacity = self.capacity
+        self.capacity *= 2
+        self.map.close()
+        self.file.truncate(_FILE_HEADER.size + self.slot_size * self.capacity)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        _FILE_HEADER.pack_into(self.map, 0, MAGIC, self.slot_size, self.capacity)
+        self.free_slots.extend(reversed(range(old_capacity, self.capacity)))
+
+    def save(self, session_id, session):
+        """Write (or overwrite) a session's saved game."""
+        key = session_id.encode("utf-8")
+        if len(key) >= KEY_SIZE:
+            raise ValueError(f"Session ids must be shorter than {KEY_SIZE} bytes")
+        self._sync_item_names()
+        record = pack_session(session, None if self.same_ids else self._to_stored)
+
+        slot = self.index.get(session_id)
+        if slot is None:
+            if not self.free_slots:
+                self._grow()
+            slot = self.index[session_id] = self.free_slots.pop()
+        elif self._record_length(slot) == OVERFLOW and len(record) <= self.slot_size - KEY_SIZE - 4:
+            os.unlink(self._overflow_path(session_id))
+
+        start = self._slot_offset(slot)
+        self.map[start] = len(key)
+        self.map[start + 1:start + 1 + len(key)] = key
+        if len(record) > self.slot_size - KEY_SIZE - 4:
+            os.makedirs(self.overflow_dir, exist_ok=True)
+            overflow_path = self._overflow_path(session_id)
+            with open(overflow_path + ".tmp", "wb") as overflow_file:
+                overflow_file.write(record)
+            os.replace(overflow_path + ".tmp", overflow_path)
+            _U32.pack_into(self.map, start + KEY_SIZE, OVERFLOW)
+            return
+        _U32.pack_into(self.map, start + KEY_SIZE, len(record))
+        record_start = start + KEY_SIZE + 4
+        self.map[record_start:record_start + len(record)] = record
+
+    def load(self, session_id):
+        """Restore a saved session, or None if there isn't one."""
+        slot = self.index.get(session_id)
+        if slot is None:
+            return None
+        convert_mask = None if self.same_ids else self._from_stored
+        record_length = self._record_length(slot)
+        if record_length == OVERFLOW:
+            with open(self._overflow_path(session_id), "rb") as overflow_file:
+                return restore_session(overflow_file.read(), self.world, convert_mask)
+        record_start = self._slot_offset(slot) + KEY_SIZE + 4
+        with memoryview(self.map) as view:
+            return restore_session(view[record_start:record_start + record_length], self.world, convert_mask)
+
+    def evict(self, session_id, session, sessions=None):
+        """Save a session and drop it from the `sessions` dict (if given) to free its memory."""
+        self.save(session_id, session)
+        if sessions is not None:
+            sessions.pop(session_id, None)
+
+    def delete(self, session_id):
+        slot = self.index.pop(session_id, None)
+        if slot is not None:
+            if self._record_length(slot) == OVERFLOW:
+                os.unlink(self._overflow_path(session_id))
+            _U32.pack_into(self.map, self._slot_offset(slot) + KEY_SIZE, 0)
+            self.free_slots.append(slot)
+
+    def __contains__(self, session_id):
+        return session_id in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def flush(self):
+        """Push the changes to disk (the OS would eventually do it anyway)."""
+        self.map.flush()
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+        self.file.close()
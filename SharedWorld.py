@@ -0,0 +1,243 @@
+# ---------------------------------
+# Shared-world multiplayer
+# ---------------------------------
+
+# Normally every player has a castle of their own. A SharedCastle is one castle
+# that many players are in at the same time: an item taken by one player is gone
+# for everyone, the zombie princess stays beaten once somebody beats her, and the
+# library's secret door is open for all once it's found.
+#
+# Players can play from different threads. There's no lock around the whole
+# castle; every command is an optimistic transaction over the rooms it touches:
+# - While a command runs, the rooms it reads are remembered with their version,
+#   and the rooms it changes are changed in the player's own copies.
+# - At the end, only the rooms it read or changed are locked (one lock per room,
+#   always taken in the same order), their versions are checked, and the changes
+#   go in, each changed room getting a new version.
+# - If another player changed one of those rooms in the meantime, the command is
+#   undone and played again against the new state of the castle.
+# Two players in different rooms never wait for each other.
+#
+#     python GameServer.py --shared --port 4000    # everyone connecting plays in one castle
+#     python SharedWorld.py --check                # players racing for the dagger
+
+import argparse
+import sys
+import threading
+
+from AdventureGame import GameSession, as_world
+
+
+class SharedCastle:
+    """
+    The state of the rooms of one castle that several players share. `states`
+    holds the committed RoomState of every room someone has changed (the others
+    are still the World's starting states); a committed RoomState is never
+    changed in place, a commit puts a new one in its place.
+    """
+
+    def __init__(self, world=None):
+        self.world = as_world(world)
+        self.states = {}    # room id -> committed RoomState
+        self.versions = {}  # room id -> number of commits that changed it
+        self.locks = {}     # room id -> Lock, made the first time a room is committed
+        self.commits = 0    # Counted without a lock, so only roughly, like any statistics
+        self.conflicts = 0
+
+    def new_session(self):
+        """A new player in this castle (usable as GameServer's session_factory)."""
+        return SharedSession(self)
+
+    def read(self, room_id):
+        """A room's committed (version, RoomState)."""
+        # The version is read first: a commit puts the state in before the new
+        # version, so a state newer than its version fails validation later.
+        version = self.versions.get(room_id, 0)
+        state = self.states.get(room_id)
+        if state is None:
+            state = self.world.start_states[room_id]
+        return version, state
+
+    def _lock(self, room_id):
+        lock = self.locks.get(room_id)
+        if lock is None:
+            lock = self.locks.setdefault(room_id, threading.Lock())
+        return lock
+
+    def commit(self, reads, writes):
+        """
+        Put a command's changed rooms (`writes`: room id -> RoomState) into the
+        castle if none of the rooms it saw (`reads`: room id -> version) changed
+        since. Returns False, changing nothing, if one did.
+        """
+        versions = self.versions
+        if not writes:
+            # Nothing to put in: the command only has to have seen one moment of the castle
+            return all(versions.get(room_id, 0) == version for room_id, version in reads.items())
+
+        locks = [self._lock(room_id) for room_id in sorted(reads.keys() | writes.keys())]
+        for lock in locks:
+            lock.acquire()
+        try:
+            for room_id, version in reads.items():
+                if versions.get(room_id, 0) != version:
+                    self.conflicts += 1
+                    return False
+            for room_id, state in writes.items():
+                self.states[room_id] = state
+                versions[room_id] = versions.get(room_id, 0) + 1
+            self.commits += 1
+            return True
+        finally:
+            for lock in locks:
+                lock.release()
+
+
+class SharedSession(GameSession):
+    """
+    One player's game in a SharedCastle. Their own state (room, inventory,
+    health...) is theirs as usual; the rooms are the castle's. Every `feed()`
+    is one transaction (see the module comment), played again if it conflicts.
+    Journals and metrics aren't supported: a command that's played again would be
+    journaled, and counted, twice.
+    """
+
+    __slots__ = ("castle", "reads", "writes")
+
+    def __init__(self, castle):
+        self.castle = castle
+        self.reads = {}   # room id -> version, of every room this command has looked at
+        self.writes = {}  # room id -> this command's changed copy of a room
+        super().__init__(castle.world)
+
+    @property
+    def room_changes(self):
+        """Every changed room as this player sees it right now (the castle's, plus this command's changes)."""
+        changes = self.castle.states.copy()
+        changes.update(self.writes)
+        return changes
+
+    @room_changes.setter
+    def room_changes(self, changes):
+        self.writes = dict(changes)
+
+    def room_state(self, room_id):
+        state = self.writes.get(room_id)
+        if state is not None:
+            return state
+        version, state = self.castle.read(room_id)
+        self.reads.setdefault(room_id, version)
+        return state
+
+    def edit_room_state(self, room_id):
+        state = self.writes.get(room_id)
+        if state is None:
+            version, state = self.castle.read(room_id)
+            self.reads.setdefault(room_id, version)
+            state = self.writes[room_id] = state.copy()
+        return state
+
+    def feed(self, line):
+        saved = self._save()
+        while True:
+            super().feed(line)
+            committed = self.castle.commit(self.reads, self.writes)
+            self.reads = {}
+            self.writes = {}
+            if committed:
+                return
+            self._restore(saved)
+
+    def think(self):
+        super().think()
+        self.reads = {}  # A hint only looks: there's nothing to commit
+
+    def _save(self):
+        player_state = self.player_state
+        return (player_state.current_room, player_state.inventory, player_state.health,
+                player_state.has_basement_key, dict(player_state.flags) if player_state.flags else None,
+                self.game_running, self.outcome, self.pending, len(self.output), self.watched)
+
+    def _restore(self, saved):
+        """Undo a command that conflicted with another player's."""
+        player_state = self.player_state
+        (player_state.current_room, player_state.inventory, player_state.health, player_state.has_basement_key,
+         flags, self.game_running, self.outcome, self.pending, said, self.watched) = saved
+        player_state.flags = dict(flags) if flags else None
+        del self.output[said:]
+
+
+# --- Trying it out ---
+
+TO_THE_OFFICE = ["ready", "go", "straight", "go", "hallway2", "go", "office"]
+
+
+def _race(castle, players):
+    """Send `players` players after the office's dagger at the same time. Returns their sessions."""
+    sessions = [castle.new_session() for _ in range(players)]
+    start = threading.Barrier(players)
+
+    def play(session):
+        for line in TO_THE_OFFICE:
+            session.feed(line)
+        start.wait()
+        session.feed("take dagger")
+
+    threads = [threading.Thread(target=play, args=(session,)) for session in sessions]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sessions
+
+
+def check(players, rounds):
+    """Race players for the dagger, then check that what one player does, the others see."""
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # Swap threads as often as possible, so commands really interleave
+    try:
+        ok = True
+        conflicts = 0
+        for _ in range(rounds):
+            castle = SharedCastle()
+            holders = [session for session in _race(castle, players) if session.player_state.has("dagger")]
+            conflicts += castle.conflicts
+            if len(holders) != 1:
+                print(f"  {len(holders)} players got the one dagger")
+                ok = False
+    finally:
+        sys.setswitchinterval(switch_interval)
+    print(f"{rounds} races of {players} players for the dagger: exactly one winner each time:"
+          f" {'yes' if ok else 'NO'} ({conflicts} commands played again after a conflict)")
+
+    castle = SharedCastle()
+    hero, other = castle.new_session(), castle.new_session()
+    for line in TO_THE_OFFICE + ["take dagger", "go", "back", "go", "bedroom", "fight"]:
+        hero.feed(line)
+    for line in TO_THE_OFFICE[:5] + ["go", "bedroom"]:
+        other.feed(line)
+    beaten = other.pending == "command" and "appears" not in other.flush()
+    print("The princess stays beaten for the next player:", "yes" if beaten else "NO")
+
+    for line in ["go", "back", "go", "back", "go", "back", "go", "upstairs", "look book"]:
+        hero.feed(line)
+    for line in ["go", "back", "go", "back", "go", "back", "go", "upstairs", "go"]:
+        other.feed(line)
+    found = "secret" in other.flush()
+    print("The secret door is open for the other player:", "yes" if found else "NO")
+    return ok and beaten and found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that players share one castle correctly.")
+    parser.add_argument("--check", action="store_true", help="race players for the dagger from many threads")
+    parser.add_argument("--players", type=int, default=8)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+    if args.check:
+        raise SystemExit(0 if check(args.players, args.rounds) else 1)
+    parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
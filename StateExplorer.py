@@ -0,0 +1,372 @@
+# ---------------------------------
+# State-space explorer
+# ---------------------------------
+
+# Plays every possible game at once: starting from a fresh castle, it tries every
+# meaningful command in every reachable state (breadth-first), and reports
+# - every winning state, with the shortest command path that reaches it
+# - every death state, with its path (and any items the fatal command handed out)
+# - rooms the player can never reach and items they can never get
+#
+# Each state is packed into one integer (see StateCodec), so the visited set stays
+# small and states are cheap to hash and send between processes.
+#
+#     python StateExplorer.py
+#     python StateExplorer.py --processes 8 --json > report.json
+
+import argparse
+import json
+from multiprocessing import Pool
+
+from AdventureGame import (
+    ENTRANCE_PATHS, PROMPTS, GameSession, PlayerState, RoomState,
+    as_world, intern_item, item_names, rule_items,
+)
+
+HEALTH_BITS = 10
+HEALTH_OFFSET = 1 << (HEALTH_BITS - 1)  # Health is stored as health + offset so it's never negative
+OUTCOMES = [None, "won", "died", "quit"]
+PARALLEL_FRONTIER = 2000  # Only bother with the process pool for frontiers bigger than this
+
+
+def _bits_for(count):
+    """Bits needed to store a number in range(count)."""
+    return max(1, (count - 1).bit_length())
+
+
+def _pack_items(code, items, masks):
+    """Append one bit per item of `masks` (item bitmasks) to `code`: whether it's in `items`."""
+    for mask in masks:
+        code = (code << 1) | bool(items & mask)
+    return code
+
+
+def _unpack_items(code, masks):
+    """Undo `_pack_items()`: (the items bitmask, what's left of `code`)."""
+    items = 0
+    for mask in reversed(masks):
+        if code & 1:
+            items |= mask
+        code >>= 1
+    return items, code
+
+
+class StateCodec:
+    """
+    Packs a session's whole game state into a single int and back.
+
+    The layout is worked out once per world: the current room, what the session
+    is waiting for, health, how the game ended, the player's flags, then the
+    inventory as a bitmask over every item in the world, and for each room its
+    `locked` bit, which enemy is there, its trigger bits, a bitmask over the items
+    it starts with (nothing is ever put down in a room) and an exit bitmask over
+    every exit the room can ever have.
+
+    Items are numbered by `item_ids`, not by the process's interned item ids, so
+    every process exploring the same world packs a state into the same int.
+    """
+
+    def __init__(self, world=None, rules=None):
+        self.world = as_world(world)
+        rules = self.world.rules if rules is None else rules
+
+        self.room_ids = list(self.world)
+        self.room_index = {room_id: index for index, room_id in enumerate(self.room_ids)}
+        self.pendings = list(PROMPTS)
+
+        items = set(rule_items(rules))
+        for room in self.world.rooms.values():
+            items.update(room["items"])
+        self.item_ids = sorted(items)
+        self.item_masks = [1 << intern_item(item) for item in self.item_ids]  # This process's bit for each
+        self.inventory_mask = sum(self.item_masks)
+
+        # Enemies: whatever a room starts with, plus anything the rules can spawn
+        self.enemies = [None]
+        for room in self.world.rooms.values():
+            if room["enemy"] and room["enemy"] not in self.enemies:
+                self.enemies.append(room["enemy"])
+        for rule in rules:
+            for effect in rule.get("effects", []):
+                if effect[0] == "spawn" and effect[1] not in self.enemies:
+                    self.enemies.append(effect[1])
+
+        self.flags = sorted(
+            {key for key in PlayerState.KEYS if key not in ("current_room", "inventory", "health")}
+            | {effect[1] for rule in rules for effect in rule.get("effects", []) if effect[0] == "set_flag"}
+        )
+
+        # Every item, trigger and exit each room can ever have
+        self.items = {room_id: [1 << intern_item(item) for item in sorted(set(room["items"]))]
+                      for room_id, room in self.world.rooms.items()}
+        self.triggers = {room_id: list(room["triggers"]) for room_id, room in self.world.rooms.items()}
+        self.exits = {room_id: list(room["exits"].items()) for room_id, room in self.world.rooms.items()}
+        for rule in rules:
+            for effect in rule.get("effects", []):
+                if effect[0] == "set_trigger" and effect[2] not in self.triggers[effect[1]]:
+                    self.triggers[effect[1]].append(effect[2])
+                elif effect[0] == "add_exit" and (effect[2], effect[3]) not in self.exits[effect[1]]:
+                    self.exits[effect[1]].append((effect[2], effect[3]))
+
+        self.room_bits = _bits_for(len(self.room_ids))
+        self.pending_bits = _bits_for(len(self.pendings))
+        self.outcome_bits = _bits_for(len(OUTCOMES))
+        self.enemy_bits = _bits_for(len(self.enemies))
+
+    # --- Packing ---
+
+    def encode(self, session):
+        player_state = session.player_state
+        if not -HEALTH_OFFSET <= player_state.health < HEALTH_OFFSET:
+            raise ValueError(f"Health {player_state.health} doesn't fit in {HEALTH_BITS} bits")
+        unknown = player_state.inventory & ~self.inventory_mask
+        if unknown:
+            raise ValueError(f"Items the world doesn't know about: {', '.join(item_names(unknown))}")
+        code = self.room_index[player_state.current_room]
+        code = (code << self.pending_bits) | self.pendings.index(session.pending)
+        code = (code << HEALTH_BITS) | (player_state.health + HEALTH_OFFSET)
+        code = (code << self.outcome_bits) | OUTCOMES.index(session.outcome)
+        for flag in self.flags:
+            code = (code << 1) | bool(player_state.get(flag))
+        code = _pack_items(code, player_state.inventory, self.item_masks)
+
+        for room_id in self.room_ids:
+            state = session.room_state(room_id)
+            code = (code << 1) | bool(state.locked)
+            code = (code << self.enemy_bits) | self.enemies.index(state.enemy)
+            triggers = state.triggers
+            for name in self.triggers[room_id]:
+                code = (code << 1) | bool(triggers.get(name))
+            code = _pack_items(code, state.items, self.items[room_id])
+            exits = state.exits
+            for direction, destination in self.exits[room_id]:
+                code = (code << 1) | (exits.get(direction) == destination)
+        return code
+
+    def decode(self, code):
+        """Rebuild a playable GameSession from a packed state."""
+        session = GameSession(self.world)
+        start_states = self.world.start_states
+
+        # Rooms were packed last, so they come off first (in reverse order)
+        for room_id in reversed(self.room_ids):
+            start = start_states[room_id]
+            exits = {}
+            for direction, destination in reversed(self.exits[room_id]):
+                if code & 1:
+                    exits[direction] = destination
+                code >>= 1
+            exits = dict(reversed(exits.items()))
+            items, code = _unpack_items(code, self.items[room_id])
+            triggers = {}
+            for name in reversed(self.triggers[room_id]):
+                triggers[name] = bool(code & 1)
+                code >>= 1
+            triggers = dict(reversed(triggers.items()))
+            enemy = self.enemies[code & ((1 << self.enemy_bits) - 1)]
+            code >>= self.enemy_bits
+            locked = bool(code & 1)
+            code >>= 1
+
+            # Rooms that are still as they started keep sharing the world's RoomState
+            if (exits, items, triggers, enemy, locked) != (
+                    start.exits, start.items, start.triggers, start.enemy, start.locked):
+                session.room_changes[room_id] = RoomState(items, exits, locked, enemy, triggers)
+
+        player_state = session.player_state
+        player_state.inventory, code = _unpack_items(code, self.item_masks)
+        for flag in reversed(self.flags):
+            player_state[flag] = bool(code & 1)
+            code >>= 1
+        session.outcome = OUTCOMES[code & ((1 << self.outcome_bits) - 1)]
+        code >>= self.outcome_bits
+        player_state.health = (code & ((1 << HEALTH_BITS) - 1)) - HEALTH_OFFSET
+        code >>= HEALTH_BITS
+        session.pending = self.pendings[code & ((1 << self.pending_bits) - 1)]
+        code >>= self.pending_bits
+        player_state.current_room = self.room_ids[code]
+        session.game_running = session.outcome is None
+        return session
+
+
+def possible_commands(session, look_objects, use_targets=None):
+    """
+    Every input that could change the state of `session` right now.
+    `use_targets` maps items to what 'use' rules let them be used on.
+    """
+    pending = session.pending
+    player_state = session.player_state
+    room_id = player_state.current_room
+    if pending == "combat":
+        return ["fight", "flee"]
+    if pending == "path":
+        if room_id == "entrance_choice":
+            return list(ENTRANCE_PATHS)
+        return list(session.room_state(room_id).exits)
+    if pending != "command":
+        return []
+
+    commands = ["go"]
+    commands.extend(f"take {item}" for item in item_names(session.room_state(room_id).items))
+    for item in item_names(player_state.inventory):
+        commands.append(f"use {item}")
+        commands.extend(f"use {item} on {target}" for target in (use_targets or {}).get(item, ()))
+    commands.extend(f"look {item}" for item in look_objects)
+    return commands
+
+
+# Worker-side state for the process pool: each worker builds its own codec once.
+_codec = None
+_look_objects = None
+_use_targets = None
+
+
+def _init_worker(world, rules):
+    global _codec, _look_objects, _use_targets
+    _codec = StateCodec(world, rules)
+    rules = _codec.world.rules if rules is None else rules
+    # 'look' only changes anything for objects a rule is written for (like the book)
+    _look_objects = sorted({rule["object"] for rule in rules if rule["verb"] == "look" and rule.get("object")})
+    _use_targets = {}
+    for rule in rules:
+        if rule["verb"] == "use" and rule.get("target"):
+            _use_targets.setdefault(rule["object"], []).append(rule["target"])
+
+
+def _expand(codes):
+    """Try every command in every state in `codes`. Returns (parent, command, child) triples."""
+    results = []
+    for code in codes:
+        commands = possible_commands(_codec.decode(code), _look_objects, _use_targets)
+        for command in commands:
+            session = _codec.decode(code)
+            session.feed(command)
+            session.output = []
+            child = _codec.encode(session)
+            if child != code:
+                results.append((code, command, child))
+    return results
+
+
+def _chunks(items, count):
+    size = max(1, -(-len(items) // count))
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+def explore(world=None, rules=None, processes=1, max_states=None):
+    """
+    Breadth-first search over every reachable state of a fresh game.
+    Returns a report dict (see module docstring); with processes > 1 each BFS level
+    is split across a process pool.
+    """
+    _init_worker(world, rules)
+    codec = _codec
+
+    start_session = GameSession(codec.world)
+    start_session.feed("ready")
+    start_session.output = []
+    start = codec.encode(start_session)
+
+    parents = {start: None}  # state -> (parent state, command)
+    wins = []
+    deaths = []
+    frontier = [start]
+
+    pool = Pool(processes, _init_worker, (world, rules)) if processes > 1 else None
+    try:
+        while frontier:
+            if max_states is not None and len(parents) >= max_states:
+                break
+            if pool is not None and len(frontier) > PARALLEL_FRONTIER:
+                results = [triple for part in pool.map(_expand, _chunks(frontier, processes * 4))
+                           for triple in part]
+            else:
+                results = _expand(frontier)
+
+            frontier = []
+            for parent, command, child in results:
+                if child in parents:
+                    continue
+                parents[child] = (parent, command)
+                session = codec.decode(child)
+                if session.outcome == "won":
+                    wins.append(child)
+                elif session.outcome == "died":
+                    deaths.append(child)
+                elif session.outcome is None:
+                    frontier.append(child)
+    finally:
+        if pool is not None:
+            pool.close()
+
+    return _report(codec, parents, wins, deaths)
+
+
+def path_to(parents, state):
+    """The commands that lead from the start to `state` (shortest, since it's BFS)."""
+    commands = []
+    while parents[state] is not None:
+        state, command = parents[state]
+        commands.append(command)
+    commands.append("ready")
+    commands.reverse()
+    return commands
+
+
+def _report(codec, parents, wins, deaths):
+    seen_rooms = set()
+    seen_inventory = 0
+    for state in parents:
+        player_state = codec.decode(state).player_state
+        seen_rooms.add(player_state.current_room)
+        seen_inventory |= player_state.inventory
+    seen_items = set(item_names(seen_inventory))
+
+    death_reports = []
+    for state in deaths:
+        player_state = codec.decode(state).player_state
+        parent_inventory = codec.decode(parents[state][0]).player_state.inventory
+        death_reports.append({
+            "path": path_to(parents, state),
+            "room": player_state.current_room,
+            "health": player_state.health,
+            # Items handed to the player by the move that killed them: usually a bug
+            "items_gained": item_names(player_state.inventory & ~parent_inventory),
+        })
+
+    return {
+        "states": len(parents),
+        "wins": [path_to(parents, state) for state in wins],
+        "deaths": death_reports,
+        "unreachable_rooms": [room_id for room_id in codec.room_ids if room_id not in seen_rooms],
+        "unobtainable_items": [item for item in codec.item_ids if item not in seen_items],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Explore every reachable Castle Escape state.")
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--max-states", type=int, default=None)
+    parser.add_argument("--json", action="store_true", help="print the full report as JSON")
+    args = parser.parse_args()
+
+    report = explore(processes=args.processes, max_states=args.max_states)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"Reachable states: {report['states']}")
+    print(f"Winning states: {len(report['wins'])}")
+    if report["wins"]:
+        print("  Shortest win:", ", ".join(min(report["wins"], key=len)))
+    print(f"Death states: {len(report['deaths'])}")
+    suspicious = [death for death in report["deaths"] if death["items_gained"]]
+    for death in suspicious:
+        print(f"  Died in {death['room']} but was given {', '.join(death['items_gained'])}:",
+              ", ".join(death["path"]))
+    print("Unreachable rooms:", ", ".join(report["unreachable_rooms"]) or "none")
+    print("Items never obtained:", ", ".join(report["unobtainable_items"]) or "none")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# ---------------------------------
+# Headless transcript runner
+# ---------------------------------
+
+# Plays scripted command transcripts (["ready", "go", "upstairs", "look book", ...])
+# without a terminal, for regression and load tests. Each transcript gets its own
+# fresh GameSession, so there are no globals to reset between runs, and the game's
+# output is collected in memory and joined once per run instead of printed.
+#
+# From the command line, give it a file with one JSON list of commands per line:
+#     python TranscriptRunner.py transcripts.jsonl > results.jsonl
+
+import argparse
+import json
+import sys
+from multiprocessing import Pool
+
+from AdventureGame import GameSession
+
+
+def run_transcript(transcript, world=None):
+    """
+    Play one transcript against a fresh world.
+    Returns a dict with:
+    - transcript: the commands that were given
+    - output: everything the game said, as one string
+    - player_state: the player state at the end
+    - outcome: "won", "died", "quit", or "unfinished" if the commands ran out first
+    - steps: how many commands were played before the game ended
+    """
+    session = GameSession(world)
+    feed = session.feed
+    steps = 0
+    for line in transcript:
+        if not session.game_running:
+            break
+        feed(line)
+        steps += 1
+
+    return {
+        "transcript": transcript,
+        "output": session.flush(),
+        "player_state": session.player_state.as_dict(),
+        "outcome": session.outcome or "unfinished",
+        "steps": steps,
+    }
+
+
+def run_transcripts(transcripts, world=None, processes=1, chunksize=256):
+    """
+    Play many transcripts, each against its own fresh world, and return their
+    results in the same order. With processes > 1 the work is spread over a
+    process pool (the world has to be picklable for that).
+    """
+    if processes <= 1:
+        return [run_transcript(transcript, world) for transcript in transcripts]
+
+    with Pool(processes) as pool:
+        return pool.starmap(
+            run_transcript, [(transcript, world) for transcript in transcripts], chunksize
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play scripted Castle Escape transcripts.")
+    parser.add_argument("transcripts", help="file with one JSON list of commands per line ('-' for stdin)")
+    parser.add_argument("--processes", type=int, default=1)
+    args = parser.parse_args()
+
+    source = sys.stdin if args.transcripts == "-" else open(args.transcripts)
+    with source:
+        transcripts = [json.loads(line) for line in source if line.strip()]
+
+    for result in run_transcripts(transcripts, processes=args.processes):
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
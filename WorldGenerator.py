@@ -0,0 +1,272 @@
+# ---------------------------------
+# Procedural world generator
+# ---------------------------------
+
+# Builds very big castles (10 thousand to a million rooms) to see how the engine
+# scales. A generated castle is the normal castle with a huge wing off the hallway:
+# a random tree of rooms (plus some extra passages between them) full of items,
+# locked doors, enemies and story triggers, in exactly the same format as `rooms`.
+# The wing comes with rules of its own, played after the castle's: every locked
+# room has a key lying somewhere on the way to the dagger that opens it from the
+# room in front of it, every enemy can be fought (easily with a weapon) or fled
+# from, and every story trigger is something to look at that sets it.
+#
+# It can always be won the same way as the castle: the dagger is hidden somewhere
+# deep in the wing, and the player needs it to beat the zombie princess, get the
+# basement key, beat the basement creatures and walk out with the final key.
+# `winning_transcript()` finds that route in any world, and `--check` plays it.
+#
+# The same seed always gives the same castle.
+#
+# From the command line:
+#     python WorldGenerator.py big.json --rooms 100000 --seed 7 --check
+#     python WorldLoader.py play big.json
+
+import argparse
+import random
+import time
+from collections import deque
+
+from AdventureGame import ENTRANCE_PATHS, GameSession, item_rules, rooms
+
+DEFAULT_ROOMS = 10_000
+DEFAULT_ITEMS = 100       # Different kinds of item lying around
+DEFAULT_WINDOW = 50       # A new room hangs off one of the last this many rooms; smaller is deeper
+ENEMY_NAMES = ("giant rat", "restless ghost", "suit of armour", "swarm of bats", "cursed portrait")
+ADJECTIVES = ("dusty", "damp", "narrow", "echoing", "cold", "cluttered", "gloomy", "draughty", "faded")
+PLACES = ("storeroom", "corridor", "gallery", "pantry", "chapel", "study", "armoury", "cellar", "parlour")
+CURIOS = ("inscription", "mural", "tapestry", "carving", "mosaic")  # What a story trigger is set by looking at
+WING = "wing"             # The hallway exit that leads into the generated wing
+
+
+def generate_world(room_count=DEFAULT_ROOMS, seed=0, items=DEFAULT_ITEMS, locked=None, enemies=None,
+                   triggers=None, passages=None, window=DEFAULT_WINDOW):
+    """
+    Build a castle with `room_count` generated rooms on top of the normal ten.
+    `locked`, `enemies`, `triggers` and `passages` (extra exits between rooms)
+    default to one per hundred rooms. Returns (rooms dict, the wing's rules).
+    """
+    rng = random.Random(seed)
+    one_percent = max(1, room_count // 100)
+    locked = one_percent if locked is None else locked
+    enemies = one_percent if enemies is None else enemies
+    triggers = one_percent if triggers is None else triggers
+    passages = one_percent if passages is None else passages
+
+    # The normal castle, with the dagger moved out of the office and a way into the wing
+    world_rooms = {room_id: dict(room) for room_id, room in rooms.items()}
+    world_rooms["office"]["items"] = [item for item in rooms["office"]["items"] if item != "dagger"]
+    world_rooms["hallway"]["exits"] = {**rooms["hallway"]["exits"], WING: "room_0"}
+
+    # A random tree: every room's parent is one of the rooms made just before it
+    ids = [f"room_{number}" for number in range(room_count)]
+    parents = [None] + [rng.randrange(max(0, number - window), number) for number in range(1, room_count)]
+    children = [0] * room_count
+    exits = [{"back": "hallway"}] + [{"back": ids[parent]} for parent in parents[1:]]
+    for number in range(1, room_count):
+        parent = parents[number]
+        children[parent] += 1
+        exits[parent][f"door_{children[parent]}"] = ids[number]
+
+    # Extra one-way passages make it a maze rather than a tree
+    for count in range(passages):
+        start, end = rng.randrange(room_count), rng.randrange(room_count)
+        if start != end:
+            exits[start][f"passage_{count}"] = ids[end]
+
+    # The dagger goes somewhere in the deeper half of the wing
+    dagger_room = rng.randrange(room_count // 2, room_count) if room_count > 1 else 0
+    # Locked doors are never on the dagger's way, and their keys always are, so
+    # the castle can still be won and every locked room can be opened
+    on_the_way = []
+    number = dagger_room
+    while number is not None:
+        on_the_way.append(number)
+        number = parents[number]
+    off_the_way = sorted(set(range(room_count)) - set(on_the_way))
+    sealed = rng.sample(off_the_way, min(locked, len(off_the_way)))
+    keys = {}  # room number -> the keys lying there
+    for number in sealed:
+        keys.setdefault(rng.choice(on_the_way), []).append(f"key{number}")
+    guarded = set(rng.sample(range(room_count), min(enemies, room_count)))
+    storied = set(rng.sample(range(room_count), min(triggers, room_count)))
+
+    item_names = [f"relic{number}" for number in range(items)]
+    no_items, no_triggers = [], {}  # Shared by every room that has none (rooms are never edited in place)
+    for number in range(room_count):
+        room_items = [rng.choice(item_names)] if item_names and rng.random() < 0.3 else no_items
+        if number == dagger_room:
+            room_items = room_items + ["dagger"]
+        if number in keys:
+            room_items = room_items + keys[number]
+        description = f"A {rng.choice(ADJECTIVES)} {rng.choice(PLACES)} deep in the castle's east wing."
+        if number in storied:
+            description += f" There's an old {CURIOS[number % len(CURIOS)]} on the wall."
+        world_rooms[ids[number]] = {
+            "description": description,
+            "items": room_items,
+            "exits": exits[number],
+            "locked": False,
+            "enemy": ({"name": rng.choice(ENEMY_NAMES), "health": 1, "damage": rng.randint(1, 5)}
+                      if number in guarded else None),
+            "triggers": {f"event_{number}": False} if number in storied else no_triggers,
+        }
+    for number in sealed:
+        world_rooms[ids[number]]["locked"] = True
+    return world_rooms, _wing_rules(world_rooms, ids, parents, sealed, guarded, storied)
+
+
+def _wing_rules(world_rooms, ids, parents, sealed, guarded, storied):
+    """The wing's own rules: its keys, its enemies and its story triggers."""
+    keys = {f"key{number}": {"use": {"say": f"The {{item}} turns in the lock. The way to {ids[number]} is open.",
+                                     "unlock": ids[number]},
+                             "room": ids[parents[number]], "consumable": True}
+            for number in sealed}
+    rules = item_rules(keys, "use")
+    for number in sorted(guarded):
+        room_id = ids[number]
+        enemy = world_rooms[room_id]["enemy"]
+        rules += [
+            {
+                "room": room_id, "verb": "fight",
+                "when": {"min_weapon": 1},
+                "effects": [("say", f"You strike down the {enemy['name']} with your {{weapon}}."), ("clear_enemy",)],
+            },
+            {
+                "room": room_id, "verb": "fight",
+                "when": {"max_weapon": 0},
+                "effects": [
+                    ("say", f"You drive off the {enemy['name']} with your bare hands, but it hurts you."),
+                    ("damage", enemy["damage"]),
+                    ("say", "Your health is now {health}."),
+                    ("clear_enemy",),
+                    ("check_defeat",),
+                ],
+            },
+            {
+                "room": room_id, "verb": "flee",
+                "effects": [("say", f"You slip past the {enemy['name']} before it can reach you.")],
+            },
+        ]
+    for number in sorted(storied):
+        room_id = ids[number]
+        curio = CURIOS[number % len(CURIOS)]
+        rules += [
+            {
+                "room": room_id, "verb": "look", "object": curio,
+                "when": {"trigger": {f"event_{number}": False}},
+                "effects": [
+                    ("set_trigger", room_id, f"event_{number}", True),
+                    ("say", "Behind the {item} you find a flask of something warm, and drink it."),
+                    ("heal", 3),
+                    ("say", "Your health is now {health}."),
+                ],
+            },
+            {
+                "room": room_id, "verb": "look", "object": curio,
+                "when": {"trigger": {f"event_{number}": True}},
+                "effects": [("say", "You've already looked behind the {item}.")],
+            },
+        ]
+    return rules
+
+
+def _find_route(world_rooms, start, goal):
+    """Exit names leading from `start` to the first room where goal(room id) is true, avoiding locked rooms."""
+    came_from = {start: None}
+    queue = deque([start])
+    while queue:
+        room_id = queue.popleft()
+        if goal(room_id):
+            route = []
+            while came_from[room_id] is not None:
+                room_id, direction = came_from[room_id]
+                route.append(direction)
+            return route[::-1]
+        for direction, destination in world_rooms[room_id]["exits"].items():
+            if destination not in came_from and not world_rooms[destination]["locked"]:
+                came_from[destination] = (room_id, direction)
+                queue.append(destination)
+    return None
+
+
+def _walk(world_rooms, start, route):
+    """Commands to follow a route, answering the enemies met on the way by fleeing."""
+    commands = []
+    room_id = start
+    for direction in route:
+        room_id = world_rooms[room_id]["exits"][direction]
+        commands += ["go", direction]
+        if world_rooms[room_id]["enemy"] and room_id not in ("bedroom", "basement", "hidden_room"):
+            commands.append("flee")  # Wing enemies let you slip past them for nothing
+    return commands, room_id
+
+
+def winning_transcript(world_rooms):
+    """
+    The commands that win a generated castle (or the normal one): fetch the
+    dagger, beat the princess and the basement creatures, and walk out.
+    Returns None if there's no way to the dagger.
+    """
+    start = ENTRANCE_PATHS["straight"]
+    to_dagger = _find_route(world_rooms, start, lambda room_id: "dagger" in world_rooms[room_id]["items"])
+    if to_dagger is None:
+        return None
+    commands = ["ready", "go", "straight"]
+    walked, dagger_room = _walk(world_rooms, start, to_dagger)
+    commands += walked + ["take dagger"]
+    walked, _ = _walk(world_rooms, dagger_room, _find_route(world_rooms, dagger_room,
+                                                             lambda room_id: room_id == "hallway2"))
+    commands += walked
+    commands += ["go", "bedroom", "fight", "go", "back", "go", "basement", "fight"]
+    walked, _ = _walk(world_rooms, "basement", _find_route(world_rooms, "basement",
+                                                           lambda room_id: room_id == "hallway"))
+    commands += walked + ["go", "back"]
+    return commands
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a very big Castle Escape world file.")
+    parser.add_argument("path", help="JSON file to write")
+    parser.add_argument("--rooms", type=int, default=DEFAULT_ROOMS, help="rooms to add to the castle")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--items", type=int, default=DEFAULT_ITEMS, help="different kinds of item")
+    parser.add_argument("--locked", type=int, help="locked rooms, each with a key (default: 1%% of the rooms)")
+    parser.add_argument("--enemies", type=int, help="rooms with an enemy (default: 1%%)")
+    parser.add_argument("--triggers", type=int, help="rooms with a story trigger (default: 1%%)")
+    parser.add_argument("--passages", type=int, help="extra passages between rooms (default: 1%%)")
+    parser.add_argument("--window", type=int, default=DEFAULT_WINDOW,
+                        help="how far back a new room's parent can be; smaller makes a deeper castle")
+    parser.add_argument("--check", action="store_true", help="play the winning route once it's written")
+    args = parser.parse_args()
+
+    from WorldLoader import save_world
+
+    began = time.perf_counter()
+    world_rooms, wing_rules = generate_world(args.rooms, args.seed, args.items, args.locked, args.enemies,
+                                             args.triggers, args.passages, args.window)
+    save_world(world_rooms, args.path, indent=None, rules=wing_rules)
+    print(f"Wrote {len(world_rooms)} rooms to {args.path} in {time.perf_counter() - began:.2f}s")
+
+    if args.check:
+        from WorldLoader import load_world
+
+        began = time.perf_counter()
+        world = load_world(args.path)
+        loaded = time.perf_counter()
+        commands = winning_transcript(world.rooms)
+        loaded_and_solved = time.perf_counter()
+        session = GameSession(world)
+        for line in commands:
+            if not session.game_running:
+                break
+            session.feed(line)
+        session.flush()
+        played = time.perf_counter()
+        print(f"Loaded in {loaded - began:.2f}s; found the {len(commands)}-command winning route in"
+              f" {loaded_and_solved - loaded:.2f}s; it played to '{session.outcome}' in"
+              f" {played - loaded_and_solved:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
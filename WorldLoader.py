@@ -0,0 +1,394 @@
+# ---------------------------------
+# World files
+# ---------------------------------
+
+# Castles don't have to be written into AdventureGame.py: a world file holds the
+# same rooms as the `rooms` dict, as JSON (or TOML):
+#     {"rooms": {"entrance_choice": {"description": "...", "exits": {...}, ...}, ...}}
+# Every field but the description can be left out (no items, no exits, unlocked,
+# no enemy, no triggers). Play starts in 'entrance_choice', like the castle.
+# A world can also bring rules of its own, written like RULES, in a "rules" list:
+# they're played after the castle's (say, what opens its locked rooms).
+#
+# Loading a world checks it first: exits that lead to missing rooms, rooms that
+# can't be reached (or are locked for good), and items the rules need that are
+# never placed anywhere.
+# The checked world is then compiled (items interned, exits as adjacency arrays)
+# and saved as a binary bundle named after a hash of the file, so the next worker
+# that loads the same file skips parsing and checking altogether.
+#
+# From the command line:
+#     python WorldLoader.py export castle.json     # write the built-in castle to a file
+#     python WorldLoader.py validate castle.json
+#     python WorldLoader.py compile castle.json    # build (or refresh) its bundle
+#     python WorldLoader.py play castle.json
+
+import argparse
+import gc
+import hashlib
+import json
+import marshal
+import os
+import sys
+import time
+from array import array
+
+from AdventureGame import (
+    DESCRIPTION_PLAYER_FIELDS, DESCRIPTION_ROOM_FIELDS, ENTRANCE_PATHS, ITEM_NAMES, RULES, GameSession, RoomState,
+    Rule, World, description_fields, intern_item, main_game_loop, rooms, rule_items,
+)
+
+BUNDLE_VERSION = 4  # 2: descriptions are checked as templates; 3: locked rooms must be openable; 4: rules
+BUNDLE_SUFFIX = ".worldbundle"
+CACHE_DIR_NAME = "__worldcache__"  # Made next to the world file, like __pycache__
+START_ROOM = "entrance_choice"
+
+ROOM_DEFAULTS = {"items": [], "exits": {}, "locked": False, "enemy": None, "triggers": {}}
+ROOM_FIELD_TYPES = {
+    "description": str,
+    "items": list,
+    "exits": dict,
+    "locked": bool,
+    "enemy": (dict, type(None)),
+    "triggers": dict,
+}
+RULE_FIELD_TYPES = {"room": str, "verb": str, "object": str, "target": str, "when": dict, "effects": list,
+                    "fallback": bool, "name": str}
+
+
+class WorldError(ValueError):
+    """A world file that can't be played. `problems` lists everything wrong with it."""
+
+    def __init__(self, problems):
+        super().__init__("\n".join(problems))
+        self.problems = problems
+
+
+# --- Reading and checking ---
+
+def parse_world(data, path=""):
+    """
+    Parse a world file's contents into (rooms dict, the world's own rules),
+    filling in the fields left out.
+    """
+    name = path or "The world file"
+    try:
+        if path.endswith(".toml"):
+            import tomllib  # Python 3.11+
+            document = tomllib.loads(data.decode("utf-8"))
+        else:
+            document = json.loads(data)
+    except json.JSONDecodeError as error:
+        problem = f"{name} isn't valid JSON: {error.msg} at line {error.lineno}, column {error.colno}."
+        raise WorldError([problem]) from error
+    except UnicodeDecodeError as error:
+        raise WorldError([f"{name} isn't UTF-8 text: {error.reason} at byte {error.start}."]) from error
+    except ValueError as error:  # tomllib.TOMLDecodeError, whose message ends with the line and column
+        raise WorldError([f"{name} isn't valid TOML: {error}."]) from error
+
+    if not isinstance(document, dict) or not isinstance(document.get("rooms"), dict):
+        raise WorldError(["A world file needs a 'rooms' table of room id -> room."])
+
+    problems = []
+    world_rooms = {}
+    for room_id, room in document["rooms"].items():
+        if not isinstance(room, dict):
+            problems.append(f"Room {room_id!r} isn't a table.")
+            continue
+        room = {**ROOM_DEFAULTS, **room}
+        for field, kind in ROOM_FIELD_TYPES.items():
+            if field not in room:
+                problems.append(f"Room {room_id!r} has no {field}.")
+            elif not isinstance(room[field], kind):
+                problems.append(f"Room {room_id!r}: {field} has the wrong type.")
+        unknown = set(room) - set(ROOM_FIELD_TYPES)
+        if unknown:
+            problems.append(f"Room {room_id!r} has unknown fields: {', '.join(sorted(unknown))}.")
+        world_rooms[room_id] = room
+
+    world_rules = document.get("rules", [])
+    if not isinstance(world_rules, list):
+        problems.append("The 'rules' of a world file have to be a list.")
+        world_rules = []
+    for number, rule in enumerate(world_rules):
+        if not isinstance(rule, dict) or not isinstance(rule.get("verb"), str):
+            problems.append(f"Rule {number} isn't a table with a verb.")
+            continue
+        wrong = [field for field, kind in RULE_FIELD_TYPES.items()
+                 if field in rule and not isinstance(rule[field], kind)]
+        unknown = set(rule) - set(RULE_FIELD_TYPES)
+        if wrong:
+            problems.append(f"Rule {number}: {', '.join(wrong)} of the wrong type.")
+        elif unknown:
+            problems.append(f"Rule {number} has unknown fields: {', '.join(sorted(unknown))}.")
+        else:
+            try:
+                Rule(number, rule)
+            except ValueError as error:
+                problems.append(f"Rule {number}: {error}.")
+    if problems:
+        raise WorldError(problems)
+    return world_rooms, world_rules
+
+
+def validate_world(world_rooms, rules=None):
+    """
+    Everything that would stop a world from being played, as a list of messages
+    (empty when the world is fine):
+    - exits that lead to rooms that don't exist
+    - descriptions with unknown {fields} (or a stray brace)
+    - rooms that can't be reached from the start, following exits, the entrance
+      paths and exits that rules add (like the library's secret door), and only
+      going into locked rooms something can open: an "unlock" rule, or for the
+      basement a rule that hands out its key
+    - items that rules ask for but that are never placed in a room or given
+    """
+    rules = RULES if rules is None else rules
+    problems = []
+    if START_ROOM not in world_rooms:
+        problems.append(f"There's no {START_ROOM!r} room to start in.")
+
+    known_fields = DESCRIPTION_ROOM_FIELDS + DESCRIPTION_PLAYER_FIELDS
+    for room_id, room in world_rooms.items():
+        for direction, destination in room["exits"].items():
+            if destination not in world_rooms:
+                problems.append(f"Exit {direction!r} of room {room_id!r} leads to a missing room {destination!r}.")
+        try:
+            unknown = [field for field in description_fields(room["description"]) if field not in known_fields]
+        except ValueError:
+            problems.append(f"The description of room {room_id!r} has a stray brace (write {{{{ or }}}} for one).")
+        else:
+            for field in unknown:
+                problems.append(f"The description of room {room_id!r} uses an unknown field {{{field}}}.")
+
+    # Exits that rules add while playing: target room -> destinations
+    added_exits = {}
+    given = set()
+    openable = set()  # Locked rooms that can be opened while playing
+    for rule in rules:
+        for effect in rule.get("effects", []):
+            if effect[0] == "add_exit":
+                added_exits.setdefault(effect[1], []).append(effect[3])
+            elif effect[0] == "give":
+                given.add(effect[1])
+            elif effect[0] == "unlock":
+                openable.add(effect[1])
+            elif effect[0] == "set_flag" and effect[1] == "has_basement_key" and effect[2]:
+                openable.add("basement")  # 'go' opens the basement for whoever has its key
+
+    if START_ROOM in world_rooms:
+        reached = {START_ROOM}
+        sealed = set()
+        frontier = [START_ROOM]
+        while frontier:
+            room_id = frontier.pop()
+            destinations = list(world_rooms[room_id]["exits"].values()) + added_exits.get(room_id, [])
+            if room_id == START_ROOM:
+                destinations += ENTRANCE_PATHS.values()
+            for destination in destinations:
+                if destination in world_rooms and destination not in reached:
+                    if world_rooms[destination]["locked"] and destination not in openable:
+                        sealed.add(destination)
+                        continue
+                    reached.add(destination)
+                    frontier.append(destination)
+        for room_id in world_rooms:
+            if room_id in sealed:
+                problems.append(f"Room {room_id!r} is locked, and nothing in the rules can open it.")
+            elif room_id not in reached:
+                problems.append(f"Room {room_id!r} can't be reached from {START_ROOM!r}.")
+
+    placed = set()
+    for room in world_rooms.values():
+        placed.update(room["items"])
+    for name in sorted(rule_items(rules) - placed - given):
+        problems.append(f"The rules use the item {name!r}, but it isn't in any room.")
+    return problems
+
+
+# --- Bundles ---
+
+def _rules_fingerprint(rules):
+    return hashlib.sha256(repr(rules).encode("utf-8")).digest()
+
+
+def bundle_key(data, rules=None):
+    """The cache key of a world file: a hash of its bytes, the bundle format and the rules it was checked with."""
+    digest = hashlib.sha256(data)
+    digest.update(str(BUNDLE_VERSION).encode())
+    digest.update(_rules_fingerprint(RULES if rules is None else rules))
+    return digest.hexdigest()
+
+
+def pack_bundle(world):
+    """A compiled World as bytes."""
+    # Item ids are only valid within one process, so the bundle keeps its own
+    # numbering, made of the items in the world in order of appearance.
+    local_ids = {}
+    room_items = []
+    for room_id in world.room_ids:
+        mask = 0
+        for name in world.rooms[room_id]["items"]:
+            mask |= 1 << local_ids.setdefault(name, len(local_ids))
+        room_items.append(mask)
+    return marshal.dumps({
+        "version": BUNDLE_VERSION,
+        "rooms": world.rooms,
+        "item_names": list(local_ids),
+        "room_items": room_items,
+        "exit_starts": world.exit_starts.tobytes(),
+        "exit_targets": world.exit_targets.tobytes(),
+        "exit_names": world.exit_names,
+        "rules": None if world.rules is RULES else world.rules,
+    })
+
+
+def unpack_bundle(data):
+    """Rebuild a World from `pack_bundle()` bytes, without checking or re-compiling it."""
+    bundle = marshal.loads(data)
+    if bundle.get("version") != BUNDLE_VERSION:
+        raise ValueError("World bundle from a different version")
+
+    # Map the bundle's item numbering onto this process's item ids
+    ids = [intern_item(name) for name in bundle["item_names"]]
+    same_ids = ids == list(range(len(ids)))
+
+    world_rooms = bundle["rooms"]
+    start_states = {}
+    for room_id, mask in zip(world_rooms, bundle["room_items"]):
+        if not same_ids and mask:
+            local, mask = mask, 0
+            while local:
+                low_bit = local & -local
+                mask |= 1 << ids[low_bit.bit_length() - 1]
+                local ^= low_bit
+        room = world_rooms[room_id]
+        start_states[room_id] = RoomState(mask, room["exits"], room["locked"], room["enemy"], room["triggers"])
+
+    exit_starts, exit_targets = array("I"), array("I")
+    exit_starts.frombytes(bundle["exit_starts"])
+    exit_targets.frombytes(bundle["exit_targets"])
+    return World(world_rooms, start_states, (exit_starts, exit_targets, bundle["exit_names"]), rules=bundle["rules"])
+
+
+def _cache_path(path, key, cache_dir):
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), CACHE_DIR_NAME)
+    return os.path.join(cache_dir, key + BUNDLE_SUFFIX)
+
+
+def _write_atomically(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as bundle_file:
+        bundle_file.write(data)
+    os.replace(temporary_path, path)  # Other workers see the whole bundle or none of it
+
+
+# --- Loading ---
+
+def compile_world(world_rooms, rules=None):
+    """Check a rooms dict and compile it into a World played with `rules`. Raises WorldError if it can't be played."""
+    problems = validate_world(world_rooms, rules)
+    if problems:
+        raise WorldError(problems)
+    return World(world_rooms, rules=rules)
+
+
+def world_rules(own_rules, rules=None):
+    """The rules a world is played with: `rules` (the castle's by default), then the world's own."""
+    if not own_rules:
+        return rules
+    return (RULES if rules is None else rules) + own_rules
+
+
+def _compile_file(data, path, rules):
+    world_rooms, own_rules = parse_world(data, path)
+    return compile_world(world_rooms, world_rules(own_rules, rules))
+
+
+def load_world(path, rules=None, cache=True, cache_dir=None):
+    """
+    Load a world file as a World, played with `rules` (the castle's by default)
+    and then the file's own. A bundle cached for exactly this file (and these
+    rules) is used when there is one; otherwise the file is parsed,
+    checked and compiled, and the bundle is written for next time.
+    """
+    with open(path, "rb") as world_file:
+        data = world_file.read()
+
+    # A big world is hundreds of thousands of new dicts, and the garbage collector
+    # would keep scanning them while they're made for no reason: nothing here is garbage.
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        if not cache:
+            return _compile_file(data, path, rules)
+
+        bundle_path = _cache_path(path, bundle_key(data, rules), cache_dir)
+        try:
+            with open(bundle_path, "rb") as bundle_file:
+                return unpack_bundle(bundle_file.read())
+        except (OSError, ValueError, EOFError, TypeError, KeyError):
+            pass  # No bundle yet, or one we can't read: build it again
+
+        world = _compile_file(data, path, rules)
+        try:
+            _write_atomically(bundle_path, pack_bundle(world))
+        except OSError:
+            pass  # A read-only directory just means no cache
+        return world
+    finally:
+        if collecting:
+            gc.enable()
+
+
+def save_world(world_rooms, path, indent=2, rules=None):
+    """Write a rooms dict (and the world's own rules) as a JSON world file (indent=None for the smallest file)."""
+    document = {"rooms": world_rooms}
+    if rules:
+        document["rules"] = rules
+    with open(path, "w") as world_file:
+        json.dump(document, world_file, indent=indent,
+                  separators=None if indent else (",", ":"))
+        world_file.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check, compile and play Castle Escape world files.")
+    parser.add_argument("command", choices=["export", "validate", "compile", "play"])
+    parser.add_argument("path", help="world file (JSON, or TOML with a .toml name)")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        save_world(rooms, args.path)
+        print(f"Wrote the castle ({len(rooms)} rooms) to {args.path}")
+        return
+
+    if args.command == "validate":
+        with open(args.path, "rb") as world_file:
+            data = world_file.read()
+        try:
+            world_rooms, own_rules = parse_world(data, args.path)
+            problems = validate_world(world_rooms, world_rules(own_rules))
+        except WorldError as error:
+            problems = error.problems
+        for problem in problems:
+            print(problem)
+        print(f"{len(problems)} problems found" if problems else "The world is fine.")
+        sys.exit(1 if problems else 0)
+
+    began = time.perf_counter()
+    try:
+        world = load_world(args.path)
+    except WorldError as error:
+        print(error)
+        sys.exit(1)
+    if args.command == "compile":
+        print(f"Loaded {len(world)} rooms and {len(ITEM_NAMES)} items in {time.perf_counter() - began:.3f}s")
+    else:
+        main_game_loop(GameSession(world))
+
+
+if __name__ == "__main__":
+    main()
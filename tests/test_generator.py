@@ -0,0 +1,86 @@
+from AdventureGame import RULES, GameSession, World
+from WorldGenerator import generate_world, winning_transcript
+from WorldLoader import load_world, save_world, validate_world
+
+wing_rooms, wing_rules = generate_world(500, seed=11)
+WING = World(wing_rooms, rules=RULES + wing_rules)
+
+
+def play(*lines):
+    session = GameSession(WING)
+    for line in lines:
+        session.feed(line)
+    return session
+
+
+def go_to(session, room_id):
+    session.feed(f"go to {room_id.replace('_', ' ')}")
+    if session.pending == "combat":
+        session.feed("flee")
+    assert session.player_state.current_room == room_id
+
+
+def first_room(test):
+    return next(room_id for room_id in WING.room_ids if room_id.startswith("room_") and test(WING.rooms[room_id]))
+
+
+def test_generated_world_is_valid_and_can_be_won():
+    assert validate_world(wing_rooms, RULES + wing_rules) == []
+    session = play(*winning_transcript(wing_rooms))
+    assert session.outcome == "won"
+
+
+def test_locked_rooms_open_with_their_key():
+    locked = [room_id for room_id in WING.room_ids if room_id.startswith("room_") and WING.rooms[room_id]["locked"]]
+    assert len(locked) == 5
+    room_id = locked[0]
+    key = f"key{room_id.split('_')[1]}"
+    key_room = first_room(lambda room: key in room["items"])
+    door = next(rule["room"] for rule in wing_rules if rule.get("object") == key)  # The room in front of it
+
+    session = play("ready")
+    assert session.world.navigation.distance(session, room_id) is None
+    go_to(session, key_room)
+    session.feed(f"take {key}")
+    go_to(session, door)
+    session.flush()
+    session.feed(f"use {key}")
+    assert "is open" in session.flush()
+    assert not session.player_state.has(key)  # Used up
+    go_to(session, room_id)
+
+
+def test_enemies_can_be_fought():
+    room_id = first_room(lambda room: room["enemy"] and not room["locked"])
+    session = play("ready", "go to " + room_id.replace("_", " "))
+    assert session.pending == "combat"
+    session.flush()
+    session.feed("fight")
+    assert "bare hands" in session.flush()
+    assert session.player_state.health == 20 - WING.rooms[room_id]["enemy"]["damage"]
+    assert session.room_state(room_id).enemy is None
+
+
+def test_looking_sets_a_story_trigger():
+    room_id = first_room(lambda room: room["triggers"] and not room["locked"])
+    curio = WING.rooms[room_id]["description"].split("an old ")[1].split()[0]
+    session = play("ready")
+    go_to(session, room_id)
+    session.flush()
+    session.feed(f"look {curio}")
+    assert "flask" in session.flush()
+    assert session.room_state(room_id).triggers == {f"event_{room_id.split('_')[1]}": True}
+    session.feed(f"look {curio}")
+    assert "already" in session.flush()
+
+
+def test_rules_come_back_with_the_world_file(tmp_path):
+    path = str(tmp_path / "wing.json")
+    save_world(wing_rooms, path, indent=None, rules=wing_rules)
+    for _ in range(2):  # Parsed, then from its bundle
+        world = load_world(path)
+        assert len(world.rule_book.rules) == len(RULES) + len(wing_rules)
+        session = GameSession(world)
+        for line in winning_transcript(world.rooms):
+            session.feed(line)
+        assert session.outcome == "won"
@@ -0,0 +1,102 @@
+import asyncio
+
+import GameServer
+from AdventureGame import GameSession, HintPlanner, castle
+
+QUICKEST = ("go to office", "take dagger", "go to bedroom", "fight", "go to basement", "fight",
+            "go to entrance choice")
+
+
+def play(*lines):
+    session = GameSession(castle)
+    for line in lines:
+        session.feed(line)
+    return session
+
+
+def test_plan_from_the_start():
+    assert HintPlanner(castle).plan(play("ready")) == QUICKEST
+
+
+def test_following_the_hints_wins():
+    planner = HintPlanner(castle)
+    session = play("ready", "go", "upstairs")
+    plan = planner.plan(session)
+    for step, command in enumerate(plan):
+        assert planner.plan(session) == plan[step:]  # The rest of a plan is cached with it
+        session.feed(command)
+    assert session.outcome == "won"
+    assert planner.misses == 1
+
+
+def test_hint_command():
+    session = play("ready")
+    session.flush()
+    session.feed("hint")
+    assert session.flush() == "Hint: try 'go to office'. The quickest way out from here is 7 steps.\n"
+
+
+def test_same_state_same_key():
+    planner = HintPlanner(castle)
+    walked = play("ready", "go", "straight", "go", "hallway2", "go", "office", "take potion", "take dagger")
+    went_to = play("ready", "go to office", "take dagger", "take potion")
+    assert planner.state_key(walked) == planner.state_key(went_to)
+    assert planner.state_key(walked) != planner.state_key(play("ready", "go to office", "take dagger"))
+
+
+def test_search_with_no_time_goes_on_where_it_stopped():
+    planner = HintPlanner(castle, time_budget=0)
+    session = play("ready")
+    calls = 1
+    while (plan := planner.plan(session)) is HintPlanner.UNFINISHED:
+        calls += 1
+        assert calls < 10000
+    assert calls > 1
+    assert plan == QUICKEST
+    assert not planner.searches
+
+
+def test_hint_while_still_searching():
+    session = play("ready")
+    session.flush()
+    planner = castle.planner
+    planner.plans.clear()
+    planner.time_budget = 0
+    try:
+        session.feed("hint")
+        assert session.flush() == "Hint: still thinking about that one. I'll tell you as soon as I know.\n"
+        assert session.thinking
+        while session.thinking:
+            session.think()
+        assert session.flush() == "Hint: try 'go to office'. The quickest way out from here is 7 steps.\n"
+    finally:
+        planner.time_budget = None
+        planner.searches.clear()
+
+
+def test_server_gives_the_hint_once_it_has_thought(monkeypatch):
+    monkeypatch.setattr(GameServer, "HINT_TIME_BUDGET", 0)  # Every search runs out of time
+    planner = castle.planner
+    planner.plans.clear()
+
+    async def ask():
+        server = GameServer.GameServer(port=0)
+        await server.start()
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+            writer.write(b"ready\nhint\n")
+            said = ""
+            while "Hint: try" not in said:
+                said += (await asyncio.wait_for(reader.read(4096), 10)).decode("utf-8")
+            writer.close()
+            return said
+        finally:
+            await server.close()
+
+    try:
+        said = asyncio.run(ask())
+    finally:
+        planner.time_budget = None
+        planner.searches.clear()
+    assert "Hint: still thinking about that one. I'll tell you as soon as I know.\n> " in said
+    assert said.endswith("Hint: try 'go to office'. The quickest way out from here is 7 steps.\n> ")
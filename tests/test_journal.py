@@ -0,0 +1,182 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+from AdventureGame import RULES, GameSession, World, castle, item_names
+from GameSupervisor import ShardWorker
+from SessionJournal import JournalWriter, attach_journal, recover_sessions
+from WorldGenerator import generate_world
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Recovers a journal in a new process that numbers the items the other way round
+RECOVER = """
+import json, sys
+from AdventureGame import RULES, World, intern_item, item_names
+from SessionJournal import recover_sessions
+from WorldGenerator import generate_world
+for number in range(99, -1, -1):
+    intern_item(f"relic{number}")
+wing_rooms, wing_rules = generate_world(200, seed=3)
+world = World(wing_rooms, rules=RULES + wing_rules)
+games = {}
+for session_id, session in recover_sessions(sys.argv[1], world).items():
+    player_state = session.player_state
+    games[session_id] = {
+        "room": player_state.current_room,
+        "inventory": sorted(item_names(player_state.inventory)),
+        "room_items": sorted(item_names(session.room_state(player_state.current_room).items)),
+    }
+print(json.dumps(games))
+"""
+
+
+def relic_rooms(world, count):
+    """The first `count` wing rooms with a relic lying in them."""
+    return [room_id for room_id in world.room_ids
+            if room_id.startswith("room_") and not world.rooms[room_id]["locked"]
+            and any(item.startswith("relic") for item in world.rooms[room_id]["items"])][:count]
+
+
+def test_journal_recovers_in_another_process(tmp_path):
+    wing_rooms, wing_rules = generate_world(200, seed=3)
+    world = World(wing_rooms, rules=RULES + wing_rules)
+    path = str(tmp_path / "games.journal")
+    writer = JournalWriter(path)
+    first, second = relic_rooms(world, 2)
+
+    session = GameSession(world)
+    attach_journal(session, writer, "a", snapshot_every=3)
+    session.feed("ready")
+    for room_id in (first, second):
+        session.feed(f"go to {room_id.replace('_', ' ')}")
+        if session.pending == "combat":
+            session.feed("flee")
+        for item in world.rooms[room_id]["items"]:
+            session.feed(f"take {item}")
+    writer.close()
+
+    player_state = session.player_state
+    expected = {
+        "room": player_state.current_room,
+        "inventory": sorted(item_names(player_state.inventory)),
+        "room_items": sorted(item_names(session.room_state(player_state.current_room).items)),
+    }
+    assert expected["inventory"]
+
+    recovered = subprocess.run([sys.executable, "-c", RECOVER, path], cwd=REPOSITORY, capture_output=True,
+                               text=True, check=True)
+    assert json.loads(recovered.stdout) == {"a": expected}
+
+
+def test_journal_recovers_in_the_same_process(tmp_path):
+    path = str(tmp_path / "games.journal")
+    writer = JournalWriter(path)
+    sessions = {}
+    for session_id, lines in (("hero", ["ready", "go to office", "take dagger", "take potion"]),
+                              ("reader", ["ready", "go", "upstairs", "look book"])):
+        session = sessions[session_id] = GameSession()
+        attach_journal(session, writer, session_id, snapshot_every=2)
+        for line in lines:
+            session.feed(line)
+    writer.close()
+
+    recovered = recover_sessions(path)
+    assert recovered.keys() == sessions.keys()
+    for session_id, session in sessions.items():
+        again = recovered[session_id]
+        assert again.player_state.current_room == session.player_state.current_room
+        assert again.player_state.inventory == session.player_state.inventory
+        assert again.room_changes.keys() == session.room_changes.keys()
+        for room_id, state in session.room_changes.items():
+            assert (again.room_changes[room_id].items, again.room_changes[room_id].exits,
+                    again.room_changes[room_id].locked) == (state.items, state.exits, state.locked)
+
+
+def test_compacted_journal_keeps_only_the_games_still_going(tmp_path):
+    path = str(tmp_path / "games.journal")
+    writer = JournalWriter(path)
+    hero, quitter = GameSession(), GameSession()
+    attach_journal(hero, writer, "hero", snapshot_every=2)
+    attach_journal(quitter, writer, "quitter")
+    for line in ["ready", "go to office", "take dagger"]:
+        hero.feed(line)
+    for line in ["ready", "quit"]:
+        quitter.feed(line)
+    writer.flush()
+    grown = writer.size
+
+    writer.compact()
+    assert writer.size == os.path.getsize(path) < grown
+    hero.feed("take potion")  # Appended after the compacted snapshots
+    writer.close()
+
+    recovered = recover_sessions(path)
+    assert list(recovered) == ["hero"]
+    assert item_names(recovered["hero"].player_state.inventory) == item_names(hero.player_state.inventory)
+    assert {"dagger", "potion"} <= set(item_names(hero.player_state.inventory))
+
+
+def test_worker_compacts_its_journal_each_time_it_doubles(tmp_path):
+    path = str(tmp_path / "worker.journal")
+    worker = ShardWorker(World(castle.rooms), path, str(tmp_path / "worker.sessions"), compact_size=4096)
+    compact = worker.journal.compact
+    compactions = []
+    worker.journal.compact = lambda world: compactions.append(compact(world))
+    for number in range(40):
+        session_id = f"player{number}"
+        lines = ["ready", "go to office", "take dagger"] + (["quit"] if number % 2 else [])
+        worker.open({"id": session_id})
+        worker.turns({"turns": [[session_id, line] for line in lines]})
+        worker.commit()
+        assert worker.journal.size < worker.compact_at
+    worker.journal.close()
+    worker.store.close()
+    assert len(compactions) > 1
+    going = [session_id for session_id, session in recover_sessions(path).items() if session.game_running]
+    assert sorted(going) == sorted(f"player{number}" for number in range(0, 40, 2))
+
+
+def test_records_wait_for_a_full_batch(tmp_path):
+    path = str(tmp_path / "games.journal")
+    writer = JournalWriter(path, batch_size=10, commit_interval=60)
+    session = GameSession()
+    attach_journal(session, writer, "hero")  # An item table and a snapshot
+    session.feed("ready")                    # The command and the new prompt
+    assert os.path.getsize(path) == 0
+    for _ in range(6):
+        session.feed("look")                 # One record each
+    assert writer.waiting == 0 and os.path.getsize(path) == writer.size > 0
+    writer.close()
+
+
+def test_old_records_are_written_with_the_next_one(tmp_path, monkeypatch):
+    path = str(tmp_path / "games.journal")
+    writer = JournalWriter(path, batch_size=1000, commit_interval=0.05)
+    session = GameSession()
+    attach_journal(session, writer, "hero")
+    session.feed("ready")
+    assert os.path.getsize(path) == 0
+    began = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: began + 1)
+    session.feed("look")
+    assert writer.waiting == 0 and os.path.getsize(path) > 0
+    writer.close()
+
+
+def test_a_record_cut_short_by_a_crash_is_left_out(tmp_path):
+    path = str(tmp_path / "games.journal")
+    writer = JournalWriter(path)
+    session = GameSession()
+    attach_journal(session, writer, "hero", snapshot_every=1000)
+    for line in ["ready", "go to office", "take dagger"]:
+        session.feed(line)
+    writer.close()
+    with open(path, "r+b") as journal_file:
+        journal_file.truncate(os.path.getsize(path) - 3)  # Into the last record, picking up the dagger
+    recovered = recover_sessions(path)["hero"]
+    assert recovered.player_state.current_room == "office"
+    assert not recovered.player_state.has("dagger")
+    assert recovered.room_state("office").items == session.world.start_states["office"].items
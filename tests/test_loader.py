@@ -0,0 +1,81 @@
+import marshal
+
+import pytest
+
+import WorldLoader
+from AdventureGame import RULES, castle, rooms
+from WorldLoader import (
+    BUNDLE_SUFFIX, BUNDLE_VERSION, CACHE_DIR_NAME, WorldError, load_world, save_world, unpack_bundle,
+)
+
+
+@pytest.mark.parametrize("name, text, problem", [
+    ("broken.json", '{"rooms": {\n  "hall": {"description": "A hall.",}\n}}',
+     "isn't valid JSON: Expecting property name enclosed in double quotes at line 2, column 37."),
+    ("broken.toml", '[rooms.hall]\ndescription = "A hall\n',
+     "isn't valid TOML: Illegal character '\\n' (at line 2, column 22)."),
+])
+def test_a_file_that_doesnt_parse_is_a_world_error(tmp_path, name, text, problem):
+    path = tmp_path / name
+    path.write_text(text)
+    with pytest.raises(WorldError) as raised:
+        load_world(str(path))
+    assert raised.value.problems == [f"{path} {problem}"]
+
+
+def test_a_file_that_isnt_text_is_a_world_error(tmp_path):
+    path = tmp_path / "binary.toml"
+    path.write_bytes(b"\xff\xfe[rooms]")
+    with pytest.raises(WorldError, match="isn't UTF-8 text: invalid start byte at byte 0"):
+        load_world(str(path))
+
+
+def castle_file(tmp_path):
+    path = str(tmp_path / "castle.json")
+    save_world(rooms, path)
+    return path
+
+
+def bundles(tmp_path):
+    return sorted((tmp_path / CACHE_DIR_NAME).glob("*" + BUNDLE_SUFFIX))
+
+
+def test_the_bundle_is_used_until_the_file_changes(tmp_path, monkeypatch):
+    path = castle_file(tmp_path)
+    world = load_world(path)
+    assert len(bundles(tmp_path)) == 1
+
+    def compile_again(*args):
+        raise AssertionError("compiled the file again")
+
+    with monkeypatch.context() as patched:
+        patched.setattr(WorldLoader, "_compile_file", compile_again)
+        cached = load_world(path)
+    assert cached.rooms == world.rooms
+    for room_id in castle.room_ids:  # The bundle numbers the items its own way
+        assert cached.start_states[room_id].items == castle.start_states[room_id].items
+    assert cached.rules is RULES
+
+    save_world({**rooms, "kitchen": {**rooms["kitchen"], "description": "A bare kitchen."}}, path)
+    assert load_world(path).rooms["kitchen"]["description"] == "A bare kitchen."
+    assert len(bundles(tmp_path)) == 2
+
+
+def test_a_bundle_that_cant_be_read_is_made_again(tmp_path):
+    path = castle_file(tmp_path)
+    load_world(path)
+    (bundle,) = bundles(tmp_path)
+    for data in (b"not a bundle", marshal.dumps({"version": BUNDLE_VERSION - 1})):
+        bundle.write_bytes(data)
+        assert load_world(path).rooms == rooms
+        assert unpack_bundle(bundle.read_bytes()).rooms == rooms
+
+
+def test_a_world_that_isnt_valid_leaves_no_bundle(tmp_path):
+    path = str(tmp_path / "broken.json")
+    save_world({**rooms, "kitchen": {**rooms["kitchen"], "exits": {"back": "pantry"}}}, path)
+    with pytest.raises(WorldError, match="leads to a missing room 'pantry'"):
+        load_world(path)
+    assert bundles(tmp_path) == []
+    load_world(castle_file(tmp_path), cache=False)
+    assert bundles(tmp_path) == []
@@ -0,0 +1,50 @@
+from AdventureGame import GameSession, castle
+from GameMetrics import Metrics, attach_metrics
+
+
+def test_commands_are_counted_by_kind():
+    metrics = Metrics()
+    session = GameSession(castle)
+    attach_metrics(session, metrics)
+    for line in ["ready", "look", "go", "upstairs", "take book", "dance"]:
+        session.feed(line)
+    counts = metrics.snapshot()["commands"]
+    assert (counts["ready"], counts["look"], counts["go"], counts["path"], counts["take"], counts["invalid"]) \
+        == (1, 1, 1, 1, 1, 1)
+    assert metrics.room_visits == {"library": 1}
+
+
+def test_a_line_after_the_game_is_over_is_counted():
+    metrics = Metrics()
+    session = GameSession(castle)
+    attach_metrics(session, metrics)
+    for line in ["ready", "quit"]:
+        session.feed(line)
+    assert session.pending == "over"
+    session.flush()
+    session.feed("look")
+    assert session.flush() == ""
+    assert metrics.snapshot()["commands"]["over"] == 1
+    assert 'castle_commands_total{command="over"} 1' in metrics.prometheus_text()
+
+
+def test_rules_are_counted_and_only_sampled_commands_timed():
+    metrics = Metrics(sample_every=4)
+    session = GameSession(castle)
+    attach_metrics(session, metrics)
+    for line in ["ready", "go to office", "take dagger", "go", "back", "go", "bedroom", "fight"]:
+        session.feed(line)
+    snapshot = metrics.snapshot()
+    assert sum(snapshot["commands"].values()) == metrics.commands == 8
+    assert sum(histogram["count"] for histogram in snapshot["command_latency_seconds"].values()) == 2
+    fired = snapshot["rules"]
+    assert sum(rule["fired"] for rule in fired.values()) == sum(metrics.rule_counts) > 0
+    assert any(name.startswith("bedroom:fight") for name in fired)
+    # Only after whole commands: not 'ready', a bare 'go' or walking into a fight
+    assert snapshot["watchers"]["victory"]["ran"] == snapshot["watchers"]["defeat"]["ran"] == 4
+
+    session.feed("quit")
+    metrics.session_ended(session)
+    assert metrics.snapshot()["sessions"]["ended"] == [{"outcome": "quit", "room": "bedroom", "count": 1}]
+    metrics.session_ended(session)  # Only counted once
+    assert metrics.session_seconds.count == 1
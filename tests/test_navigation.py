@@ -0,0 +1,105 @@
+from collections import deque
+
+import pytest
+
+import AdventureGame
+from AdventureGame import ENTRANCE_PATHS, RULES, GameSession, NavigationIndex, World, castle
+from WorldGenerator import generate_world
+
+wing_rooms, wing_rules = generate_world(300, seed=5, passages=30)
+SMALL_WING = World(wing_rooms, rules=RULES + wing_rules)
+
+
+def can_enter(session, room_id):
+    return not session.room_state(room_id).locked or (
+        room_id == "basement" and session.player_state.has_basement_key)
+
+
+def brute_force_distances(session, start):
+    """Moves from `start` to every room it can get to, by a plain BFS over what the session sees."""
+    distances = {start: 0}
+    queue = deque([start])
+    while queue:
+        room_id = queue.popleft()
+        if room_id == "entrance_choice":
+            destinations = ENTRANCE_PATHS.values()
+        else:
+            destinations = session.room_state(room_id).exits.values()
+        for destination in destinations:
+            if destination not in distances and can_enter(session, destination):
+                distances[destination] = distances[room_id] + 1
+                queue.append(destination)
+    return distances
+
+
+def check_against_brute_force(session, starts, targets):
+    navigation = session.world.navigation
+    for start in starts:
+        session.player_state.current_room = start
+        expected = brute_force_distances(session, start)
+        for target in targets:
+            assert navigation.distance(session, target) == expected.get(target), (start, target)
+            route = navigation.route(session, target)
+            if target not in expected:
+                assert route is None
+                continue
+            # The route is as long as the distance, and every step is a way out of the room it's taken from
+            room_id = start
+            for direction in route:
+                if room_id == "entrance_choice":
+                    room_id = ENTRANCE_PATHS[direction]
+                else:
+                    room_id = session.room_state(room_id).exits[direction]
+                assert can_enter(session, room_id)
+            assert room_id == target
+            assert len(route) == expected[target]
+
+
+def play(world, *lines):
+    session = GameSession(world)
+    for line in lines:
+        session.feed(line)
+    return session
+
+
+@pytest.mark.parametrize("lines", [
+    ["ready"],
+    ["ready", "go", "upstairs", "look book"],  # The library's secret door is open
+])
+def test_castle_distances_match_a_bfs(lines):
+    session = play(castle, *lines)
+    check_against_brute_force(session, castle.room_ids, castle.room_ids)
+
+
+def test_castle_distances_with_the_basement_key():
+    session = play(castle, "ready")
+    session.player_state.has_basement_key = True
+    check_against_brute_force(session, castle.room_ids, castle.room_ids)
+    assert castle.navigation.distance(session, "basement") is not None
+
+
+def test_generated_wing_distances_match_a_bfs():
+    session = play(SMALL_WING, "ready")
+    room_ids = SMALL_WING.room_ids
+    check_against_brute_force(session, room_ids[::7], room_ids[::11] + ["entrance_choice", "basement"])
+
+
+def test_path_and_go_to():
+    session = play(castle, "ready", "go to office")
+    assert session.player_state.current_room == "office"
+    session.flush()
+    session.feed("path library")
+    assert session.flush() == "To get to the library: go back, go back, go back, go upstairs (4 moves).\n"
+    session.feed("path basement")  # Locked until the princess gives up its key
+    assert session.flush() == "You don't know a way to the basement from here.\n"
+
+
+def test_table_cache_is_sized_by_the_world(monkeypatch):
+    assert NavigationIndex(castle).cache_size == 256
+    monkeypatch.setattr(AdventureGame, "NAVIGATION_CACHE_BYTES", 8 * len(SMALL_WING) * 5)
+    navigation = NavigationIndex(SMALL_WING)
+    assert navigation.cache_size == 5
+    session = play(SMALL_WING, "ready")
+    for room_id in SMALL_WING.room_ids[::10]:
+        navigation.distance(session, room_id)
+    assert len(navigation.tables) == 5
@@ -0,0 +1,61 @@
+from AdventureGame import GameSession, RoomRenderer, World, rooms
+
+
+def world_with(**descriptions):
+    return World({room_id: {**room, "description": descriptions.get(room_id, room["description"])}
+                  for room_id, room in rooms.items()})
+
+
+def in_the_office(world):
+    session = GameSession(world)
+    for line in ["ready", "go to office"]:
+        session.feed(line)
+    session.flush()
+    return session
+
+
+def test_players_in_the_same_room_share_its_text():
+    world = world_with()
+    first, second = in_the_office(world), in_the_office(world)
+    renderer = world.renderer
+    assert renderer.describe(first, "office") is renderer.describe(second, "office")
+    first.feed("take dagger")
+    first.feed("look")
+    assert first.flush().endswith("Items you see here: potion\n")
+    assert renderer.describe(second, "office")[1] == "Items you see here: dagger, potion"
+
+
+def test_templated_descriptions_fill_in_the_player_every_time():
+    world = world_with(office="A cramped office. You feel {health} hit points of tired. Exits: {exits}.")
+    session = in_the_office(world)
+    session.feed("look")
+    assert session.flush().startswith("A cramped office. You feel 20 hit points of tired. Exits: back.\n")
+    session.player_state.health = 7
+    session.feed("look")
+    assert session.flush().startswith("A cramped office. You feel 7 hit points of tired. Exits: back.\n")
+    assert len([key for key in world.renderer.rendered if key[0] == "office"]) == 1
+
+
+def test_only_the_fields_a_description_uses_tell_rooms_apart():
+    plain, listed = world_with(), world_with(library="Books everywhere. Ways out: {exits}.")
+    for world in (plain, listed):
+        reader, other = GameSession(world), GameSession(world)
+        for line in ["ready", "go", "upstairs"]:
+            reader.feed(line)
+            other.feed(line)
+        reader.feed("look book")  # Opens the secret door for the reader only
+        world.renderer.describe(reader, "library")
+        world.renderer.describe(other, "library")
+    assert len([key for key in plain.renderer.rendered if key[0] == "library"]) == 1
+    assert len([key for key in listed.renderer.rendered if key[0] == "library"]) == 2
+    assert listed.renderer.describe(reader, "library")[0] == "Books everywhere. Ways out: downstairs, secret."
+
+
+def test_a_full_cache_starts_again():
+    world = world_with()
+    world.renderer = RoomRenderer(world, cache_size=2)
+    session = GameSession(world)
+    for line in ["ready", "go", "straight", "go", "kitchen"]:
+        session.feed(line)
+    assert len(world.renderer.rendered) <= 2
+    assert session.flush().endswith("Items you see here: food\n")
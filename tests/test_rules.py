@@ -0,0 +1,97 @@
+import AdventureGame
+from AdventureGame import ITEMS, RULES, GameSession, RuleBook, _weapon_tiers, castle, intern_item, rule_book
+
+
+def play(*lines):
+    session = GameSession(castle)
+    for line in lines:
+        session.feed(line)
+    return session
+
+
+def scan(rules, room_id, verb, item):
+    """The rules that could answer a command, found the slow way: every rule, in order."""
+    return [order for order, spec in enumerate(rules)
+            if spec["verb"] == verb and spec.get("room") in (room_id, None)
+            and spec.get("object") in ({item, None} if item is not None else {None})]
+
+
+def test_candidates_are_every_rule_that_could_answer_in_order():
+    verbs = {spec["verb"] for spec in RULES}
+    objects = {spec.get("object") for spec in RULES} | {None, "nothing at all"}
+    for room_id in list(castle.room_ids) + ["nowhere"]:
+        for verb in verbs:
+            for item in objects:
+                found = [rule.order for rule in rule_book.candidates(room_id, verb, item)]
+                assert found == scan(RULES, room_id, verb, item), (room_id, verb, item)
+
+
+def test_candidates_from_several_buckets_keep_declared_order():
+    book = RuleBook([
+        {"verb": "look", "effects": []},
+        {"room": "attic", "verb": "look", "object": "box", "effects": []},
+        {"verb": "look", "object": "box", "effects": []},
+        {"room": "attic", "verb": "look", "effects": []},
+    ])
+    assert [rule.order for rule in book.candidates("attic", "look", "box")] == [0, 1, 2, 3]
+    assert [rule.order for rule in book.candidates("cellar", "look", "box")] == [0, 2]
+    assert [rule.order for rule in book.candidates("attic", "look", None)] == [0, 3]
+
+
+def test_room_rule_beats_the_fallback():
+    session = play("ready", "go", "upstairs")
+    session.flush()
+    session.feed("look book")
+    assert "A secret door opens" in session.flush()
+    session.feed("look book")
+    said = session.flush()
+    assert "already discovered" in said
+    assert "examine" not in said
+
+
+def test_fallback_answers_when_no_other_rule_does():
+    session = play("ready", "go", "upstairs")
+    session.flush()
+    session.feed("look candle")
+    assert session.flush() == "You don't see a candle here.\n"
+
+
+def test_combat_rules_pick_the_weapon():
+    armed = play("ready", "go", "straight", "go", "hallway2", "go", "office", "take dagger",
+                 "go", "back", "go", "bedroom", "fight")
+    assert armed.player_state.has_basement_key
+    unarmed = play("ready", "go", "straight", "go", "hallway2", "go", "bedroom", "fight")
+    assert not unarmed.player_state.has_basement_key
+    assert unarmed.player_state.health < armed.player_state.health
+
+
+def test_a_stronger_weapon_fights_like_the_strongest_known(monkeypatch):
+    monkeypatch.setattr(AdventureGame, "WEAPON_TIERS", _weapon_tiers({**ITEMS, "axe": {"weapon": 3}}))
+    session = play("ready", "go", "straight", "go", "hallway2", "go", "office", "take dagger", "go", "back")
+    session.player_state.inventory |= 1 << intern_item("axe")
+    session.flush()
+    session.feed("go")
+    session.feed("bedroom")
+    session.feed("fight")
+    said = session.flush()
+    assert "You strike the zombie princess with your axe, defeating her!" in said
+    assert "dagger" not in said
+    assert session.player_state.has_basement_key
+    assert session.room_state("bedroom").enemy is None
+
+
+def test_weapon_tiers_combine_the_weapons_of_a_tier():
+    tiers = _weapon_tiers({"club": {"weapon": 1}, "knife": {"weapon": 1}, "spear": {"weapon": 2}, "food": {}})
+    assert [tier for tier, _ in tiers] == [2, 1]
+    assert tiers[1][1] == (1 << intern_item("club")) | (1 << intern_item("knife"))
+
+
+def test_a_story_watcher_runs_the_checks_again(monkeypatch):
+    trap = {"name": "trap", "reads": ["inventory"], "room": "office", "when": {"has": "dagger"},
+            "effects": [("say", "The floor gives way!"), ("damage", 25)]}
+    monkeypatch.setattr(AdventureGame, "watch_list", AdventureGame.WatchList(AdventureGame.WATCHERS + [trap]))
+    session = play("ready", "go to office", "take potion")
+    assert session.game_running
+    session.feed("take dagger")
+    assert session.flush().endswith("The floor gives way!\nYou have died!\n")
+    assert session.outcome == "died"
@@ -0,0 +1,86 @@
+import sys
+import threading
+
+from SharedWorld import TO_THE_OFFICE, SharedCastle
+
+
+def in_the_office(castle, players):
+    sessions = [castle.new_session() for _ in range(players)]
+    for session in sessions:
+        for line in TO_THE_OFFICE:
+            session.feed(line)
+        session.flush()
+    return sessions
+
+
+def test_one_winner_when_players_race_for_the_dagger():
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # Swap threads as often as possible, so commands really interleave
+    try:
+        for _ in range(50):
+            castle = SharedCastle()
+            sessions = in_the_office(castle, 6)
+            start = threading.Barrier(len(sessions))
+
+            def take(session):
+                start.wait()
+                session.feed("take dagger")
+
+            threads = [threading.Thread(target=take, args=(session,)) for session in sessions]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            holders = [session for session in sessions if session.player_state.has("dagger")]
+            assert len(holders) == 1
+            assert sum("You picked up the dagger" in session.flush() for session in sessions) == 1
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+
+def test_conflicting_command_is_played_again():
+    castle = SharedCastle()
+    slow, quick = in_the_office(castle, 2)
+    commit = castle.commit
+
+    def quick_commits_first(reads, writes):
+        if not quick.player_state.has("dagger"):
+            castle.commit = commit
+            quick.feed("take dagger")  # Gets in while the slow player's command is still running
+            castle.commit = quick_commits_first
+        return commit(reads, writes)
+
+    castle.commit = quick_commits_first
+    slow.feed("take dagger")
+    assert castle.conflicts == 1
+    assert quick.player_state.has("dagger")
+    assert not slow.player_state.has("dagger")
+    assert slow.flush() == "You can't find dagger here.\n"  # The first try's output is gone
+
+
+def test_players_see_each_others_changes():
+    castle = SharedCastle()
+    hero, other = castle.new_session(), castle.new_session()
+    for line in ["ready", "go", "upstairs", "look book"]:
+        hero.feed(line)
+    for line in ["ready", "go", "upstairs", "go"]:
+        other.feed(line)
+    assert "secret" in other.flush()
+    assert other.room_state("hidden_room").locked is False
+
+
+def test_answering_an_enemy_someone_else_beat():
+    castle = SharedCastle()
+    hero, other = castle.new_session(), castle.new_session()
+    for line in TO_THE_OFFICE + ["take dagger", "go", "back"]:
+        hero.feed(line)
+    for line in TO_THE_OFFICE[:5] + ["go", "bedroom"]:
+        other.feed(line)
+    assert other.pending == "combat"
+    for line in ["go", "bedroom", "fight"]:
+        hero.feed(line)
+    other.flush()
+    other.feed("flee")
+    assert other.flush() == "There's nothing left to fight here.\n"
+    assert other.player_state.health == 20
+    assert other.pending == "command"
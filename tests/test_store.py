@@ -0,0 +1,105 @@
+import os
+import struct
+
+import pytest
+
+from AdventureGame import GameSession
+from SessionStore import OVERFLOW_SUFFIX, SessionStore, pack_session, restore_session
+
+
+def played(*lines):
+    session = GameSession()
+    for line in lines:
+        session.feed(line)
+    session.flush()
+    return session
+
+
+def same_game(restored, session):
+    player_state, again = session.player_state, restored.player_state
+    assert (again.current_room, again.inventory, again.health, again.has_basement_key, again.flags) \
+        == (player_state.current_room, player_state.inventory, player_state.health, player_state.has_basement_key,
+            player_state.flags)
+    assert (restored.pending, restored.game_running, restored.outcome) \
+        == (session.pending, session.game_running, session.outcome)
+    assert restored.room_changes.keys() <= session.room_changes.keys()
+    for room_id in session.room_changes:
+        state, again_state = session.room_state(room_id), restored.room_state(room_id)
+        assert (again_state.items, again_state.exits, again_state.locked, again_state.enemy, again_state.triggers) \
+            == (state.items, state.exits, state.locked, state.enemy, state.triggers)
+
+
+def test_games_come_back_as_they_were_left(tmp_path):
+    path = str(tmp_path / "games.db")
+    games = {
+        "fresh": played(),
+        "reader": played("ready", "go", "upstairs", "look book", "go", "secret"),  # At the statue's prompt
+        "hero": played("ready", "go to office", "take dagger", "take potion", "go", "back", "go", "bedroom",
+                       "fight", "go", "back", "go", "basement"),
+    }
+    games["hero"].player_state["lit_lamp"] = True
+    store = SessionStore(path)
+    for session_id, session in games.items():
+        store.save(session_id, session)
+    store.close()
+
+    store = SessionStore(path)  # Found again from the file alone
+    assert len(store) == 3
+    for session_id, session in games.items():
+        same_game(store.load(session_id), session)
+    store.delete("fresh")
+    assert store.load("fresh") is None
+    store.close()
+
+
+def test_big_records_overflow_and_the_store_grows(tmp_path):
+    path = str(tmp_path / "games.db")
+    store = SessionStore(path, slot_size=128, capacity=2)
+    session = played("ready", "go to office")
+    for number in range(20):
+        session.player_state[f"flag_number_{number}"] = True  # Too much for a 128 byte slot
+    for session_id in ("a", "b", "c"):
+        store.save(session_id, session)
+    assert store.capacity == 4
+    assert len(os.listdir(path + OVERFLOW_SUFFIX)) == 3
+    session.player_state.flags = None
+    store.save("b", session)  # Fits in its slot again
+    assert len(os.listdir(path + OVERFLOW_SUFFIX)) == 2
+    store.close()
+    store = SessionStore(path)
+    for session_id in ("a", "b", "c"):
+        assert store.load(session_id).player_state.current_room == "office"
+    assert store.load("b").player_state.flags is None
+    store.close()
+
+
+def test_health_past_16_bits_is_saved(tmp_path):
+    store = SessionStore(str(tmp_path / "games.db"))
+    for health in (40000, -40000):
+        session = played("ready")
+        session.player_state.health = health
+        store.save("hero", session)
+        assert store.load("hero").player_state.health == health
+    store.close()
+
+
+def test_a_session_that_doesnt_fit_is_a_value_error(tmp_path):
+    store = SessionStore(str(tmp_path / "games.db"))
+    session = played("ready")
+    session.player_state.health = 2 ** 40
+    with pytest.raises(ValueError):
+        store.save("hero", session)
+    assert "hero" not in store
+    store.close()
+
+
+def test_version_1_records_still_restore():
+    session = played("ready", "go to office", "take dagger")
+    record = pack_session(session)
+    header = struct.Struct("<BBBiBI")
+    version, pending, outcome, health, flag_bits, room_index = header.unpack_from(record, 0)
+    old = struct.pack("<BBBhBI", 1, pending, outcome, health, flag_bits, room_index) + record[header.size:]
+    restored = restore_session(old)
+    assert restored.player_state.current_room == "office"
+    assert restored.player_state.has("dagger")
+    assert restored.player_state.health == session.player_state.health
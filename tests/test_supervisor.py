@@ -0,0 +1,52 @@
+import asyncio
+
+from AdventureGame import RULES, GameSession, World, castle
+from GameSupervisor import ShardWorker, attach_world, check, share_world
+from WorldGenerator import generate_world, winning_transcript
+
+
+def play(world, lines):
+    session = GameSession(world)
+    for line in lines:
+        session.feed(line)
+    return session
+
+
+def test_a_shared_world_plays_like_the_one_it_was_made_from():
+    wing_rooms, wing_rules = generate_world(300, seed=9)
+    world = World(wing_rooms, rules=RULES + wing_rules)
+    block = share_world(world)
+    try:
+        shared = attach_world(block.name)
+        assert list(shared.room_ids) == list(world.room_ids)
+        assert all(shared.rooms[room_id] == world.rooms[room_id] for room_id in world.room_ids[::17])
+        assert (list(shared.exit_starts), list(shared.exit_targets), list(shared.exit_names)) \
+            == (list(world.exit_starts), list(world.exit_targets), list(world.exit_names))
+        assert (list(shared.locked_rooms), shared.item_rooms) == (list(world.locked_rooms), world.item_rooms)
+        assert shared.rules == world.rules
+
+        transcript = winning_transcript(wing_rooms)
+        here, there = play(world, transcript), play(shared, transcript)
+        assert there.outcome == here.outcome == "won"
+        assert there.flush() == here.flush()
+    finally:
+        block.close()
+        block.unlink()
+
+
+def test_a_worker_plays_a_batch_of_turns(tmp_path):
+    worker = ShardWorker(World(castle.rooms), str(tmp_path / "worker.journal"), str(tmp_path / "worker.sessions"))
+    for session_id in ("hero", "quitter"):
+        worker.open({"id": session_id})
+    results = worker.turns({"turns": [["hero", "ready"], ["quitter", "ready"], ["hero", "go to office"],
+                                      ["quitter", "quit"], ["nobody", "look"]]})["results"]
+    assert [result["prompt"] for result in results] == ["> ", "> ", "> ", None, None]
+    assert "DAGGER on the desk" in results[2]["output"]
+    assert results[4]["output"] == "Sorry, your game has been lost.\n"
+    assert list(worker.sessions) == ["hero"]
+    worker.journal.close()
+    worker.store.close()
+
+
+def test_a_game_carries_on_after_its_worker_dies():
+    assert asyncio.run(check(2))